@@ -1,5 +1,8 @@
 from ..utils import die, cached_property
+from queue import Queue
+from time import perf_counter
 from types import GeneratorType
+import threading
 
 
 class cached_attr(cached_property):
@@ -16,8 +19,10 @@ class die(die):
     BAD_COL = 'unknown column: %r'
     BAD_REL = 'unknown relation: %r'
     INCOMPO = '%r: %s and %s are incompossible'
+    NO_AIO = 'no AsyncDatabase for %r'
     NO_B2 = '%r has no BELONGS_TO: %s'
     NO_PAGE = 'page() not called'
+    NO_PAGE_AFTER = 'page_after() not called'
     NO_PK = 'no primary key on %r'
     NO_TA = 'no table alias for %r'
 
@@ -26,11 +31,29 @@ class die(die):
         raise ColumnNotLoaded(k)
 
 
+def _est_bytes(v):
+    return (len(v) if v.isascii() else len(v.encode())) + 2 \
+        if isinstance(v, str) else 2 * len(v) + 3 if isinstance(v, bytes) \
+        else 24
+
+
 class BulkLoader():
-    def __init__(self, db, table, columns, *, per=None, suffix=''):
+    def __init__(self, db, table, columns, *, per=None, suffix='',
+                 upsert=None, conflict=(), changed_only=False,
+                 max_bytes=None, background=0):
         self.db = db
         self.per = per
-        self.count = 0
+        self.background = int(background)  # queue depth
+        self.max_bytes = max_bytes  # None: the server's packet limit
+        self.bytes = self.count = self.flushes = 0
+        self.inserted = self.updated = 0
+        self.seconds = 0.0
+        self.table = table
+        self.upsert = upsert
+        if upsert is not None:
+            suffix and die.incompo(self, 'suffix', 'upsert')
+            suffix = db.upsert_sql(
+                table, tuple(columns), upsert, conflict, changed_only)
         self._sql = (
             f"INSERT INTO {table} ({', '.join(columns)}) VALUES\n",
             suffix and ("\n" + suffix))
@@ -38,32 +61,134 @@ class BulkLoader():
         cs = ', '.join(columns.values() if d else ('%s',) * len(columns))
         self._cs = (f'({cs})',)
         self._nc = cs.count('%s') if d else len(columns)
-        self._nr = 0
+        self._mb = None  # byte budget, from the server on the first add()
+        self._nb = self._nr = 0
         self._vs = []
+        self._commit = True
+        self._error = self._q = self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(exc_type is None)
 
     def _build(self):
         xs = ",\n".join(self._cs * self._nr)
         s1, s2 = self._sql
         return f'{s1}{xs}{s2}' if s2 else (s1 + xs)
 
+    def _budget(self):
+        mb = self.max_bytes
+        if mb is None:
+            mb = self.db.max_packet()
+            if mb:
+                s1, s2 = self._sql
+                mb = int(mb * 0.95) - len(s1) - len(s2)
+        return mb or 0
+
+    def _raise(self):
+        e = self._error
+        if e is not None:
+            raise e
+
+    def _run(self, sql, vs, nr, nb):
+        db = self.db
+        t = perf_counter()
+        if self.upsert is None:
+            csr = db.execute(sql, vs)
+        else:
+            with db.checkout():  # counts are read off the connection
+                csr = db.execute(sql, vs)
+                i, u = db.upsert_counts(csr, nr, self.upsert)
+            self.inserted += i
+            self.updated += u
+        db.bump_tables(self.table)
+        self.seconds += perf_counter() - t
+        self.bytes += nb
+        self.count += nr
+        self.flushes += 1
+        return csr
+
+    def _work(self):  # on its own connection, in one transaction
+        db = self.db
+        q = self._q
+        done = False
+        try:
+            with db.checkout():
+                try:
+                    db.begin()
+                    while not done:
+                        x = q.get()
+                        done = x is None
+                        done or self._run(*x)
+                    db.commit() if self._commit else db.rollback()
+                except BaseException:
+                    try:
+                        db.txn_depth and db.rollback()
+                    except BaseException:
+                        pass
+                    raise
+                finally:
+                    if db.pool is None:
+                        lc = db.local
+                        con, lc.con = lc.con, None
+                        con is None or con.close()
+        except BaseException as e:
+            self._error = self._error or e
+        while not done:  # the producer must never block on a full queue
+            done = q.get() is None
+
     def add(self, *vs):
+        self._error is None or self._raise()
         len(vs) == self._nc or die.n_args('add()', self._nc, 'p', len(vs))
+        n = len(self._cs[0]) + 2 + sum(_est_bytes(v) for v in vs)
+        mb = self._mb
+        if mb is None:
+            mb = self._mb = self._budget()
+        if self._nr and mb and self._nb + n > mb:
+            self.execute()
+        self._nb += n
         self._nr += 1
         self._vs.extend(vs)
         self.per and self._nr >= self.per and self.execute()
         return self
 
     def clear(self):
-        self._nr = 0
+        self._nb = self._nr = 0
         self._vs.clear()
         return self
 
+    def close(self, commit=True):
+        if commit and self._error is None:
+            self.execute()
+        else:
+            self.clear()
+        t = self._thread
+        if t is not None:
+            self._commit = commit
+            self._q.put(None)
+            t.join()
+            self._thread = None
+            self._raise()
+
     def execute(self):
+        self._error is None or self._raise()
         if self._nr:
-            csr = self.db.execute(self._build(), self._vs)
-            self.count += self._nr
-            self.clear()
-            return csr
+            x = (self._build(), self._vs, self._nr, self._nb)
+            if not self.background:
+                csr = self._run(*x)
+                self.clear()
+                return csr
+
+            if self._thread is None:
+                self._q = Queue(self.background)
+                self._thread = threading.Thread(
+                    target=self._work, name='py3x-bulk-loader', daemon=True)
+                self._thread.start()
+            self._vs = []  # the worker owns the old one
+            self._nb = self._nr = 0
+            self._q.put(x)
 
     def extend(self, vss):
         for vs in vss:
@@ -73,11 +198,70 @@ class BulkLoader():
     def sql(self):
         return SQL(self._build(), *self._vs)
 
+    def stats(self):
+        return dict(rows=self.count, bytes=self.bytes, flushes=self.flushes,
+                    seconds=self.seconds)
+
 
 class ColumnNotLoaded(Exception):
     pass
 
 
+class CopyLoader:
+    def __init__(self, db, table, columns, *, per=10000, py2dbs=None):
+        self.db = db
+        self.per = per
+        self.count = 0
+        self.table = table
+        self.columns = tuple(columns)
+        self._fs = tuple((i, f) for i, f in enumerate(py2dbs or ()) if f)
+        self._nc = len(self.columns)
+        self._rs = []
+
+    def _copy(self, vss):
+        db = self.db
+        n = db.copy_rows(self.table, self.columns, self._rows(vss))
+        db.bump_tables(self.table)
+        self.count += n
+        return n
+
+    def _rows(self, vss):
+        fs = self._fs
+        nc = self._nc
+        for vs in vss:
+            len(vs) == nc or die.n_args('extend()', nc, 'p', len(vs))
+            if fs:
+                vs = [*vs]
+                for i, f in fs:
+                    vs[i] = f(vs[i])
+            yield vs
+
+    def add(self, *vs):
+        len(vs) == self._nc or die.n_args('add()', self._nc, 'p', len(vs))
+        self._rs.append(vs)
+        self.per and len(self._rs) >= self.per and self.execute()
+        return self
+
+    def clear(self):
+        self._rs.clear()
+        return self
+
+    def execute(self):
+        if self._rs:
+            n = self._copy(self._rs)
+            self.clear()
+            return n
+
+    def extend(self, vss):
+        self.execute()
+        self._copy(vss)  # streamed as it is consumed
+        return self
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
 class RecordNotFound(Exception):
     pass
 
@@ -135,6 +319,7 @@ class Operator(SQL):
     __slots__ = ()
 
 
+ANY = SQL.ANY = lambda vs: Operator('= ANY(%s)', [*vs])
 BETWEEN = SQL.BETWEEN = lambda v1, v2: Operator('BETWEEN %s AND %s', v1, v2)
 GE = SQL.GE = lambda v: Operator('>= %s', v)
 GT = SQL.GT = lambda v: Operator('> %s', v)
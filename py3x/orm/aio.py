@@ -0,0 +1,80 @@
+from . import die
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+import asyncio
+
+
+class AsyncDatabase:
+    def __init__(self, db, workers=4):
+        db.aio is None or die(TypeError(f'{db!r} already has {db.aio!r}'))
+        self.db = db
+        self.cons = []
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            workers, 'py3x-db', initializer=self._init_worker)
+        db.aio = self
+
+    def _init_worker(self):
+        db = self.db
+        if db.pool is None:
+            self.cons.append(db._con)  # one connection per worker thread
+
+    def close(self):
+        self.executor.shutdown()
+        cons = self.cons
+        while cons:
+            cons.pop().close()
+        self.db.aio = None
+
+    def execute(self, sql, vs=None, as_=tuple):
+        def f():
+            x = self.db.execute(sql, vs, as_)
+            return [*x] if as_ is tuple else x
+        return self.run(f)
+
+    async def iterate(self, it, size=1000):
+        loop = asyncio.get_running_loop()
+        q = asyncio.Queue(2)
+        stop = []
+
+        def put(x):
+            asyncio.run_coroutine_threadsafe(q.put(x), loop).result()
+
+        def produce():
+            try:
+                while not stop:
+                    xs = [*islice(it, size)]
+                    put(xs)
+                    if not xs:
+                        break
+            except BaseException as e:
+                put(e)
+            finally:
+                it.close()
+
+        f = self.run(produce)
+        try:
+            while True:
+                xs = await q.get()
+                if not isinstance(xs, list):
+                    raise xs
+                if not xs:
+                    break
+                for x in xs:
+                    yield x
+        finally:
+            stop.append(True)
+            while not q.empty():
+                q.get_nowait()
+            await f
+
+    def run(self, fn, *args, **kw):
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(fn, *args, **kw) if args or kw else fn)
+
+    def txn(self, fn, *args, **kw):
+        def f():
+            with self.db.txn_do():
+                return fn(*args, **kw)
+        return self.run(f)
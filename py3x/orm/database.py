@@ -1,7 +1,13 @@
-from ..utils import cached_property, die
+from . import PoolTimeout, SQL
+from ..utils import cached_property, die, try_
 from functools import lru_cache
+from itertools import count
+from time import monotonic, perf_counter
+from weakref import WeakValueDictionary
 import os
 import re
+import sys
+import threading
 
 
 @lru_cache(256)
@@ -20,6 +26,437 @@ class Cursor0:
         return self.csr.fetchone()[0]
 
 
+class CachedCursor:
+    __slots__ = ('description', 'rs')
+
+    def __init__(self, description, rs):
+        self.description = description
+        self.rs = rs
+
+    def __iter__(self):
+        return iter(self.rs)
+
+
+def _copy_esc(b):
+    return b.replace(b'\\', b'\\\\').replace(b'\t', b'\\t') \
+        .replace(b'\n', b'\\n').replace(b'\r', b'\\r')
+
+
+class CopyStream:
+    def __init__(self, rows, bytes2db=_copy_esc):
+        self.bytes2db = bytes2db
+        self.count = self._n = 0
+        self.rows = iter(rows)
+        self._bs = []
+
+    def line(self, vs):
+        b2db = self.bytes2db
+        return b'\t'.join(
+            b'\\N' if v is None else
+            (b'1' if v else b'0') if v is True or v is False else
+            b2db(v) if isinstance(v, bytes) else
+            _copy_esc((v if isinstance(v, str) else str(v)).encode())
+            for v in vs) + b'\n'
+
+    def read(self, size=-1):
+        bs = self._bs
+        n = self._n
+        while size < 0 or n < size:
+            vs = next(self.rows, None)
+            if vs is None:
+                break
+            b = self.line(vs)
+            bs.append(b)
+            n += len(b)
+            self.count += 1
+
+        x = b''.join(bs)
+        bs.clear()
+        if 0 <= size < n:
+            bs.append(x[size:])
+            x = x[:size]
+        self._n = n - len(x)
+        return x
+
+
+class ExecuteEvent:
+    __slots__ = ('db', 'sql', 'vs', 'caller', 'elapsed', 'rowcount')
+
+    def __init__(self, db, sql, vs):
+        self.db = db
+        self.sql = sql
+        self.vs = vs
+        self.caller = db.caller_of(sys._getframe(3))
+        self.elapsed = self.rowcount = None
+
+    def __repr__(self):
+        return '%s(%r, %r, elapsed=%r, rowcount=%r)' % (
+            self.__class__.__name__, self.sql, self.vs, self.elapsed,
+            self.rowcount)
+
+
+class Hook:
+    __slots__ = ('before', 'after', 'error')
+
+    def __init__(self, before=None, after=None, error=None):
+        self.before = before
+        self.after = after
+        self.error = error
+
+
+class IdentityScope:
+    __slots__ = ('db', 'fc', 'prev')
+
+    def __init__(self, db, fc):
+        self.db = db
+        self.fc = fc
+        self.prev = db.find_cache
+        db.find_cache = fc
+
+    def __enter__(self):
+        return self.fc
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db.find_cache = self.prev
+
+
+class IdentityStats:
+    def _init(self, scope):
+        scope in ('request', 'txn') or die(TypeError(
+            'unknown identity map scope: %r' % scope))
+        self.scope = scope
+        self.hits = self.misses = self.evictions = 0
+
+    def _evicted(self, k, r):
+        self.evictions += 1
+        r._fck_() == k and r._fck_(True)
+
+    def clear(self):
+        super().clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self),
+                    maxsize=self.maxsize)
+
+
+class IdentityMap(IdentityStats, dict):
+    def __init__(self, maxsize=None, scope='txn'):
+        self._init(scope)
+        self.maxsize = maxsize
+
+    def __setitem__(self, k, r):
+        n = self.maxsize
+        if n is not None and len(self) >= n and k not in self:
+            x = next(iter(self))
+            self._evicted(x, self.pop(x))
+        super().__setitem__(k, r)
+
+    def get(self, k, nx=None):
+        r = self.pop(k, None)
+        if r is None:
+            self.misses += 1
+            return nx
+        self.hits += 1
+        super().__setitem__(k, r)  # most recently used goes last
+        return r
+
+
+class Checkout:
+    __slots__ = ('db',)
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db._pin()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db._unpin()
+
+
+class Local(threading.local):  # per thread: never share a transaction
+    con = find_cache = request_memo = None
+    pins = txn_depth = 0
+    dirty = False  # wrote outside a transaction: kept until commit()
+    txn_tables = frozenset()  # written in the open transaction
+    rw_until = 0.0
+
+
+class Pipeline:
+    def __init__(self, db):
+        self.db = db
+        self.items = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        exc_type or self.execute()
+
+    def _query(self, q):
+        'type' in q.kw and die(TypeError('pipeline() takes only SELECT'))
+        'in_chunks' in q.kw and die(TypeError('IN is split into chunks'))
+        return q
+
+    def add(self, x):
+        if isinstance(x, SQL):
+            self.items.append((x, False, None))
+        else:
+            self.items.append((self._query(x).sql(), False, x))
+        return self
+
+    def count(self, q, one=1):
+        self.items.append((self._query(q)._build('SELECT_').wrap(
+            f'(SELECT COUNT({one}) %s)'), True, int))
+        return self
+
+    def execute(self):
+        items = self.items
+        self.items = []
+        xs = self.db.reader().execute_sets([x[:2] for x in items])
+        self.results = rs = []
+        for (_, scalar, f), x in zip(items, xs):
+            rs.append(f(x) if scalar else x.rs if f is None else
+                      f._loaded([*f._hydrate(x)]))
+        return rs
+
+    def exists(self, q):
+        self.items.append((self._query(q).exists_sql(), True, bool))
+        return self
+
+
+class Pool:
+    def __init__(self, connect, ping=None, reset=None, *, min_size=1,
+                 max_size=10, timeout=30.0, idle=300.0, ping_after=1.0):
+        0 <= min_size <= max_size or die(ValueError(
+            f'min_size={min_size} max_size={max_size}'))
+        self.connect = connect
+        self.ping = ping
+        self.ping_after = ping_after  # idle seconds before a ping
+        self.reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = idle
+        self.cond = threading.Condition()
+        self.cons = []  # [(returned_at, con)] oldest first
+        self.closed = False
+        self.size = 0
+        self.checkouts = self.timeouts = self.waits = 0
+        self.wait_max = self.wait_time = 0.0
+
+    def _open(self):
+        try:
+            return self.connect()
+        except BaseException:
+            self._lost()
+            raise
+
+    def _lost(self):
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def _put(self, con):
+        t = monotonic()
+        with self.cond:
+            if self.closed:
+                self.size -= 1
+                xs = [con]
+            else:
+                self.cons.append((t, con))
+                xs = self._recycle(t)
+            self.cond.notify()
+        for x in xs:
+            x.close()
+
+    def _recycle(self, t):
+        cs = self.cons
+        xs = []
+        while cs and self.size > self.min_size and t - cs[0][0] > self.idle:
+            xs.append(cs.pop(0)[1])
+            self.size -= 1
+        return xs
+
+    def _timeout(self, t0):
+        self.timeouts += 1
+        self._waited(t0)
+        raise PoolTimeout(f'no connection available in {self.timeout}s')
+
+    def _waited(self, t0):
+        w = monotonic() - t0
+        self.wait_time += w
+        if w > self.wait_max:
+            self.wait_max = w
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            xs = [con for t, con in self.cons]
+            self.cons = []
+            self.size -= len(xs)
+            self.cond.notify_all()
+        for con in xs:
+            con.close()
+
+    def fill(self):
+        while True:
+            with self.cond:
+                if self.size >= self.min_size:
+                    return self
+                self.size += 1
+            self._put(self._open())
+
+    def get(self):
+        t0 = monotonic()
+        cond = self.cond
+        while True:
+            with cond:
+                if not (self.cons or self.size < self.max_size or
+                        self.closed):
+                    self.waits += 1
+                    cond.wait_for(
+                        lambda: (self.cons or self.size < self.max_size or
+                                 self.closed),
+                        max(t0 + self.timeout - monotonic(), 0)) or \
+                        self._timeout(t0)
+                self.closed and die('connection pool is closed')
+                xs = self._recycle(monotonic())
+                t, con = self.cons.pop() if self.cons else (0.0, None)
+                if con is None:
+                    self.size += 1
+            for x in xs:
+                x.close()
+
+            if con is None:
+                con = self._open()
+            elif self.ping and monotonic() - t > self.ping_after:
+                try:
+                    self.ping(con)
+                except Exception:
+                    self._lost()
+                    try_(con.close)
+                    continue
+
+            with cond:
+                self.checkouts += 1
+                self._waited(t0)
+            return con
+
+    def put(self, con, reset=True):
+        if reset and self.reset:
+            try:
+                self.reset(con)  # no transaction may leak to the next user
+            except Exception:
+                self._lost()
+                try_(con.close)
+                return
+        self._put(con)
+
+    def stats(self):
+        with self.cond:
+            n = len(self.cons)
+            return dict(
+                size=self.size, idle=n, in_use=self.size - n,
+                max_size=self.max_size,
+                utilization=(self.size - n) / self.max_size,
+                checkouts=self.checkouts, waits=self.waits,
+                timeouts=self.timeouts, wait_time=self.wait_time,
+                wait_max=self.wait_max)
+
+
+class RequestScope:
+    __slots__ = ('db', 'rc')
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        db = self.db
+        self.rc = db.request_memo
+        rc = db.request_memo = ResultCache(db.REQUEST_CACHE_SIZE)
+        return rc
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db.request_memo = self.rc
+
+
+class ResultCache(dict):
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+
+    def clear(self):
+        super().clear()
+        self.hits = self.misses = 0
+
+    def fetch(self, k, ver, ttl, execute):
+        t = monotonic()
+        x = self.pop(k, None)
+        if x and x[1] == ver and (x[0] is None or x[0] > t):
+            self.hits += 1
+            self[k] = x  # most recently used goes last
+            return CachedCursor(*x[2:])
+
+        self.misses += 1
+        csr = execute()
+        x = (None if ttl is None else t + ttl, ver, csr.description, [*csr])
+        len(self) >= self.maxsize and self.pop(next(iter(self), None), None)
+        self[k] = x
+        return CachedCursor(*x[2:])
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self), maxsize=self.maxsize)
+
+
+class StreamCursor:
+    def __init__(self, csr, size, done=None):
+        self.csr = csr
+        self.done = done
+        self.size = size
+        self.rs = csr.fetchmany(size)  # description may be set after fetch
+        self.description = csr.description
+
+    def __iter__(self):
+        csr = self.csr
+        rs = self.rs
+        self.rs = None
+        try:
+            while rs:
+                yield from rs
+                rs = csr.fetchmany(self.size)
+        finally:
+            csr.close()
+            self.done and self.done()
+
+
+class WeakIdentityMap(IdentityStats, WeakValueDictionary):
+    maxsize = None
+
+    def __init__(self, scope='txn'):
+        super().__init__()
+        self._init(scope)
+        remove = self._remove
+
+        def _remove(wr):
+            self.evictions += 1
+            remove(wr)
+        self._remove = _remove  # entries go with their last reference
+
+    def get(self, k, nx=None):
+        r = super().get(k)
+        if r is None:
+            self.misses += 1
+            return nx
+        self.hits += 1
+        return r
+
+
 class Database:
     from .query import Query
     from ..utils import Util
@@ -27,45 +464,227 @@ class Database:
         r'\(\s*SELECT|[\(\)]|\b(?:'
         r'(?:LEFT |RIGHT |INNER |OUTER |CROSS |FULL |STRAIGHT_)*JOIN|'
         r'FROM|WHERE|(?:ORDER|GROUP) BY|HAVING|UNION)', re.IGNORECASE)
+    COUNT_CACHE_SIZE = 1024
+    REPLICA_POLICIES = ('round_robin', 'least_loaded')
+    REQUEST_CACHE_SIZE = 4096
+    RESULT_CACHE_SIZE = 256
     RE_MIGRATE_SQL = re.compile(r'\A(\d{3})_.*\.sql\Z')
 
     shared_index = staticmethod(_shared_index)
 
-    def __init__(self, is_debug=False, **kw):
+    def __init__(self, is_debug=False, pool=None, replicas=None,
+                 replica_policy='round_robin', read_your_writes=0, **kw):
+        replica_policy in self.REPLICA_POLICIES or die(TypeError(
+            'unknown replica policy: %r' % replica_policy))
+        self.aio = None
         self.is_debug = is_debug
         self.con_kw = kw
-        self.find_cache = None
-        self.txn_depth = 0
-
-    @cached_property
+        self.count_cache = {}
+        self.hooks = ()
+        self.local = Local()
+        self.pool = None if pool is None else Pool(
+            lambda: self.connect(**self.con_kw), self.ping, self.reset_con,
+            **({} if pool is True else pool))
+        self.inflight = 0
+        self.read_your_writes = read_your_writes
+        self.replica_policy = replica_policy
+        self.replica_seq = count()
+        self.replicas = tuple(
+            self.__class__(is_debug, pool, **x) for x in (replicas or ()))
+        self.table_versions = {}
+
+    @property
     def _con(self):
-        return self.connect(**self.con_kw)
+        lc = self.local
+        con = lc.con
+        if con is None:
+            p = self.pool
+            con = lc.con = self.connect(**self.con_kw) if p is None else \
+                p.get()
+        return con
+
+    @_con.setter
+    def _con(self, con):
+        self.local.con = con
+
+    def _execute_hooked(self, csr, sql, vs):
+        x = ExecuteEvent(self, sql, vs)
+        hs = self.hooks
+        for h in hs:
+            h.before and h.before(x)
+        t = perf_counter()
+        try:
+            csr.execute(sql, vs)
+        except Exception as e:
+            x.elapsed = perf_counter() - t
+            for h in hs:
+                h.error and h.error(x, e)
+            raise
+        x.elapsed = perf_counter() - t
+        x.rowcount = getattr(csr, 'rowcount', None)
+        for h in hs:
+            h.after and h.after(x)
 
     def _con_x(self, x):
-        self.txn_depth = 0
+        lc = self.local
+        lc.txn_depth = int(x == 'begin')
+        lc.dirty = False
         m = getattr(self._con, x, None)
         if m:
             self.is_debug and self.debug(x.upper(), None)
             m()
         else:
             self.execute(x.upper())
+        self.pool is None or self._release_idle()
+
+    def _keep_write(self, csr):
+        lc = self.local
+        if not (lc.txn_depth or lc.dirty or csr.description or
+                self.autocommit(lc.con)):
+            lc.dirty = True  # else released and rolled back uncommitted
+
+    def _pin(self):
+        self.local.pins += 1
+
+    def _release_idle(self):
+        lc = self.local
+        lc.txn_depth or lc.pins or lc.dirty or self.release()
+
+    def _set_sqls(self, items):
+        ss = [x for x, scalar in items if scalar]
+        xs = [x for x, scalar in items if not scalar]
+        ss and xs.insert(0, SQL(  # scalar ones share a single SELECT
+            'SELECT ' + ', '.join(x._t[0] for x in ss),
+            *(v for x in ss for v in x._t[1])))
+        return xs
+
+    def _sets(self, items, rss):
+        it = iter(rss)
+        vs = any(scalar for x, scalar in items) and iter(next(it).rs[0])
+        return [next(vs) if scalar else next(it) for x, scalar in items]
+
+    def _unpin(self):
+        self.local.pins -= 1
+        self._release_idle()
+
+    def _set_hooks(self, hs):
+        self.hooks = hs
+        for r in self.replicas:
+            r.hooks = hs
+
+    def add_hook(self, before=None, after=None, error=None):
+        h = Hook(before, after, error)
+        self._set_hooks((*self.hooks, h))
+        return h
+
+    def autocommit(self, con):
+        return False
 
     def begin(self):
         self._con_x('begin')
         self.txn_depth = 1
         fc = self.find_cache
-        fc and fc.clear()
+        fc and getattr(fc, 'scope', 'txn') == 'txn' and fc.clear()
+
+    def bulk_update(self, table, ks, rs, nw=1):
+        pk = ks[0]
+        ss = []
+        vs = []
+        for i, k in enumerate(ks[nw:], nw):
+            ss.append(f"{k} = CASE {pk}{' WHEN %s THEN %s' * len(rs)} END")
+            vs.extend(v for r in rs for v in (r[0], r[i]))
+        p = '(' + ', '.join(('%s',) * nw) + ')' if nw > 1 else '%s'
+        w = '(' + ', '.join(ks[:nw]) + ')' if nw > 1 else pk
+        vs.extend(v for r in rs for v in r[:nw])
+        sql = f"UPDATE {table} SET {', '.join(ss)} " \
+            f"WHERE {w} IN ({', '.join((p,) * len(rs))})"
+        if nw == 1:
+            if self.execute(sql, vs, int) == len(rs):
+                return {r[0] for r in rs}
+            # MySQL counts changed rows only: the rest are those still there
+            return {x[0] for x in self.execute(
+                f"SELECT {pk} FROM {table} WHERE {pk} IN "
+                f"({', '.join(('%s',) * len(rs))})", [r[0] for r in rs],
+                tuple)}
+
+        with self.txn_do() as t:
+            if self.execute(sql, vs, int) == len(rs):
+                return {r[0] for r in rs}
+
+            # which rows lost the race can't be told from what they hold
+            # now, so undo it and go one row at a time
+            t.rollback()
+            sql = f"UPDATE {table} SET {' = %s, '.join(ks[nw:])} = %s " \
+                f"WHERE {' = %s AND '.join(ks[:nw])} = %s"
+            return {r[0] for r in rs
+                    if self.execute(sql, (*r[nw:], *r[:nw]), int)}
+
+    def bump_tables(self, *ts):
+        tvs = self.table_versions
+        for t in ts:
+            tvs[t] = tvs.get(t, 0) + 1
+        if self.txn_depth:  # bumped again once the writes are visible
+            self.local.txn_tables |= frozenset(ts)
+        self.replicas and self.mark_write()
+
+    def caller_of(self, f, depth=8):
+        from .model import Model, ModelClass
+        Q = self.Query
+        while f and depth:
+            for k in ('self', 'cls'):
+                x = f.f_locals.get(k)
+                if isinstance(x, (Q, Model, ModelClass)):
+                    return x
+            f = f.f_back
+            depth -= 1
+
+    def checkout(self):
+        return Checkout(self)
 
     def close(self):
-        con = self.__dict__.pop('_con', None)
+        for r in self.replicas:
+            r.close()
+        p = self.pool
+        if p is not None:
+            self.release()
+            return p.close()
+        lc = self.local
+        con = lc.con
+        lc.con = None
         return con and con.close()
 
     def commit(self):
         self._con_x('commit')
+        lc = self.local
+        ts = lc.txn_tables
+        if ts:
+            lc.txn_tables = frozenset()
+            self.bump_tables(*ts)
 
     def connect(self, **kw):
         raise NotImplementedError
 
+    def copy_rows(self, table, columns, rows):
+        raise NotImplementedError
+
+    def count_cached(self, sql, ttl):
+        cc = self.count_cache
+        try:
+            hash(sql)
+        except TypeError:  # e.g. a list bound to ANY(%s)
+            return self.read(*sql, 1)[0]
+        t = monotonic()
+        x = cc.get(sql)
+        if x and x[0] > t:
+            return x[1]
+        n = self.read(*sql, 1)[0]
+        len(cc) >= self.COUNT_CACHE_SIZE and sql not in cc and cc.clear()
+        cc[sql] = (t + ttl, n)
+        return n
+
+    def count_estimate(self, sql, table=None):
+        raise NotImplementedError
+
     def debug(self, sql, vs, print=print):
         if "\n" not in sql and (len(sql) >= self.Util.TERM_W or 'JOIN' in sql):
             sql = self.debug_(sql, 0)
@@ -118,14 +737,60 @@ class Database:
     def execute(self, sql, vs=None, as_=tuple):
         self.is_debug and self.debug(sql, vs)
         csr = self._con.cursor()
-        csr.execute(sql, vs)
+        try:
+            if self.hooks:
+                self._execute_hooked(csr, sql, vs)
+            else:
+                csr.execute(sql, vs)
+            self.pool is None or self._keep_write(csr)
+        finally:
+            self.pool is None or self._release_idle()
         return csr if as_ is tuple else \
             csr.rowcount if as_ is int else \
             csr.fetchone() if as_ == 1 else die(as_)
 
+    def execute_cached(self, sql, vs, ts, ttl=None):
+        rc = self.request_memo if ttl is None or self.txn_depth else \
+            self.result_cache
+        k = (sql, tuple(vs) if vs else ())
+        try:
+            rc is None or hash(k)
+        except TypeError:
+            rc = None
+        if rc is None:
+            return self.read(sql, vs, tuple)
+        tvs = self.table_versions
+        ver = tuple(tvs.get(t, 0) for t in ts)
+        return rc.fetch(k, ver, ttl, lambda: self.read(sql, vs, tuple))
+
+    def execute_sets(self, items):
+        sqls = self._set_sqls(items)
+        with self.checkout():
+            rss = [CachedCursor(csr.description, [*csr])
+                   for csr in (self.execute(*x, tuple) for x in sqls)]
+        return self._sets(items, rss)
+
     def execute_insert(self, sql, txn, ai):
         raise NotImplementedError
 
+    def execute_insert_many(self, sql, vs, ai, n):
+        raise NotImplementedError
+
+    @property
+    def find_cache(self):
+        return self.local.find_cache
+
+    @find_cache.setter
+    def find_cache(self, fc):
+        self.local.find_cache = fc
+
+    def identity_map(self, maxsize=None, weak=False, scope='txn'):
+        return IdentityScope(self, WeakIdentityMap(scope) if weak else
+                             IdentityMap(maxsize, scope))
+
+    def max_packet(self):
+        return None
+
     def migrate(self, dir, model, stdout=None):  # pragma: no cover
         v2f = {}
         for f in sorted(os.listdir(dir)):
@@ -152,18 +817,118 @@ class Database:
                     stdout and print('')
                     model(version=ver).insert()
 
+    def pipeline(self):
+        return Pipeline(self)
+
+    def ping(self, con):
+        csr = con.cursor()
+        csr.execute('SELECT 1')
+        csr.close()
+
+    def mark_write(self):
+        self.local.rw_until = monotonic() + self.read_your_writes
+
     def pluck(self, sql, vs=()):
-        csr = self.execute(sql, vs, tuple)
+        csr = self.read(sql, vs, tuple)
         return Cursor0(csr) if len(csr.description) == 1 else csr
 
     def quote(self, v):
         raise NotImplementedError
 
+    def stream(self, sql, vs=None, size=1000):
+        self.is_debug and self.debug(sql, vs)
+        p = self.pool
+        p and self._pin()  # keep the connection until the cursor is done
+        try:
+            csr = self.stream_cursor(size)
+            if self.hooks:
+                self._execute_hooked(csr, sql, vs)
+            else:
+                csr.execute(sql, vs)
+        except BaseException:
+            p and self._unpin()
+            raise
+        return StreamCursor(csr, size, p and self._unpin)
+
+    def stream_cursor(self, size):
+        return self._con.cursor()
+
+    def read(self, sql, vs=None, as_=tuple):
+        r = self.reader()
+        if r is self:
+            return self.execute(sql, vs, as_)
+        r.inflight += 1
+        try:
+            return r.execute(sql, vs, as_)
+        finally:
+            r.inflight -= 1
+
+    def read_stream(self, sql, vs=None, size=1000):
+        return self.reader().stream(sql, vs, size)
+
+    def reader(self):
+        rs = self.replicas
+        if rs:
+            lc = self.local
+            if not (lc.txn_depth or lc.pins or lc.dirty or
+                    monotonic() < lc.rw_until):
+                return min(rs, key=lambda r: r.inflight) if \
+                    self.replica_policy == 'least_loaded' else \
+                    rs[next(self.replica_seq) % len(rs)]
+        return self
+
+    def release(self):
+        lc = self.local
+        con = lc.con
+        if con is not None and self.pool is not None:
+            lc.con = None
+            self.pool.put(con, lc.dirty)  # only after close() mid-write
+            lc.dirty = False
+
+    def remove_hook(self, h):
+        self._set_hooks(tuple(x for x in self.hooks if x is not h))
+
+    @property
+    def request_memo(self):
+        return self.local.request_memo
+
+    @request_memo.setter
+    def request_memo(self, rc):
+        self.local.request_memo = rc
+
+    def request_cache(self):
+        return RequestScope(self)
+
+    @cached_property
+    def result_cache(self):
+        return ResultCache(self.RESULT_CACHE_SIZE)
+
     def reset(self):
         raise NotImplementedError
 
+    def reset_con(self, con):
+        con.rollback()
+
     def rollback(self):
         self._con_x('rollback')
+        self.local.txn_tables = frozenset()
+        rc = self.request_memo
+        rc and rc.clear()
+
+    def upsert_counts(self, csr, n, upsert):
+        raise NotImplementedError
+
+    def upsert_sql(self, table, columns, upsert, conflict=(),
+                   changed_only=False):
+        raise NotImplementedError
+
+    @property
+    def txn_depth(self):
+        return self.local.txn_depth
+
+    @txn_depth.setter
+    def txn_depth(self, v):
+        self.local.txn_depth = v
 
     def txn_do(self):
         return Transaction(self)
@@ -195,6 +960,8 @@ class Transaction:
             sp = db.txn_depth = self.sp
             db.execute(f'ROLLBACK TO SAVEPOINT p{sp}' if exc_type else
                        f'RELEASE SAVEPOINT p{sp}')
+            rc = exc_type and db.request_memo
+            rc and rc.clear()
 
     def rollback(self):
         db = self.db
@@ -205,4 +972,6 @@ class Transaction:
             sp = db.txn_depth = self.sp
             db.execute(f'ROLLBACK TO SAVEPOINT p{sp}')
             db.execute(f'SAVEPOINT p{sp}')
+            rc = db.request_memo
+            rc and rc.clear()
             db.txn_depth = sp + 1
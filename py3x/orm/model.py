@@ -1,4 +1,4 @@
-from . import RecordNotFound, SQL, cached_attr, die
+from . import IN, RecordNotFound, SQL, cached_attr, die
 from ..utils import _NX, cached_class_property, cached_property, repr_kw
 
 
@@ -25,6 +25,79 @@ def _attr_in_db(self, obj, cls=None, col=None, nld=die):
         return v
 
 
+class CompactAccessor:
+    __slots__ = ('accessor', 'col', 'set')
+
+    def __init__(self, accessor):
+        self.accessor = accessor
+        self.col = accessor.col
+        self.set = getattr(accessor, '__set__', None)
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self.col
+        col = self.col
+        k = col.name
+        k2i = obj._k2i
+        if k2i is None:  # __dict__ in use
+            d = obj.__dict__
+            return d[k] if k in d else self.accessor.__get__(obj, cls)
+
+        k in k2i or die.col_nld(k)
+        v = obj._dbvs[k2i[k]]
+        db2py = col.db2py
+        if db2py and db2py is not True:
+            v = db2py(v)
+            if isinstance(v, (dict, list, set)):
+                obj.__dict__[k] = v  # keep in-place changes
+        return v
+
+    def __set__(self, obj, v):
+        # never through the instance's shared-key values (see _compact_dict)
+        s = self.set
+        if s is None:
+            obj.__dict__[self.col.name] = v
+        else:
+            s(obj, v)
+
+    def __delete__(self, obj):
+        del obj.__dict__[self.col.name]
+
+
+def _compact_dict(self, _dict=None):
+    k2i = self._k2i
+    if k2i is None:
+        return _dict.__get__(self)
+    # a fresh dict keeps the class' shared keys (and new instances) small
+    d = {**_dict.__get__(self), '.k2i': k2i, '.dbvs': self._dbvs}
+    fck = self._fck
+    if fck is not None:
+        d['.fck'] = fck
+    _dict.__set__(self, d)
+    self._k2i = self._dbvs = self._fck = None
+    return d
+
+
+def _compact_fck(self, pop=False):
+    if self._k2i is None:
+        return Model._fck_(self, pop)
+    fck = self._fck
+    if pop:
+        self._fck = None
+    return fck
+
+
+def _compact_in_db(self, k):
+    k2i = self._k2i
+    if k2i is None:
+        return Model._in_db_(self, k)
+    if k not in k2i:
+        return _NX
+    v = self._dbvs[k2i[k]]
+    db2py = self.COLUMNS[k].db2py
+    return db2py(v) if db2py and db2py is not True else v
+
+
 class ModelClass(type):
     # def __new__(cls, *args):
     #     cls = super().__new__(cls, *args)
@@ -36,12 +109,16 @@ class ModelClass(type):
 
 
 class Model(ModelClass('ModelClass', (), {})):
-    from . import BulkLoader
+    from . import BulkLoader, CopyLoader
     from ..errors import Errors
 
     class NO_CHANGES:
         pass
 
+    CACHE_TTL = 60
+    COMPACT = False
+    COUNT_STRATEGY = 'exact'
+    COUNT_TTL = 60
     DB_INDEXES = ()
     MAX_PER_PAGE = 1000
     PER_PAGE = 25
@@ -68,6 +145,19 @@ class Model(ModelClass('ModelClass', (), {})):
             d['.fck'] = fck
         return r
 
+    @classmethod
+    def _unique_key_(cls, kw):
+        (k, v), = kw.items()
+        c = cls.COLUMNS.get(k)
+        if c is None or not c.unique or v is None or isinstance(v, SQL):
+            return
+        pt = c.PY_TYPE
+        if not isinstance(v, pt):
+            v = c.form2py(v)
+            if not isinstance(v, pt):
+                return
+        return cls.DB_TABLE, k, v
+
     @cached_class_property
     def AUTO_INCREMENT(cls):
         pk = cls.PRIMARY_KEY
@@ -165,6 +255,36 @@ class Model(ModelClass('ModelClass', (), {})):
             k and die(TypeError(f'{cls}.{k} does not start with PRIMARY_KEY'))
             all(die.incompo(cs[k], 'primary_key', 'py2db')
                 for k in pk if cs[k].py2db is not None)
+        cls.COMPACT and cls._compact_()
+
+    @classmethod
+    def _compact_(cls):
+        _dict = next(c.__dict__['__dict__'] for c in cls.__mro__
+                     if '__dict__' in c.__dict__)
+        ns = {
+            '__dict__': property(lambda r: _compact_dict(r, _dict)),
+            '__module__': cls.__module__,
+            '__qualname__': cls.__qualname__,
+            '__slots__': ('_k2i', '_dbvs', '_fck'),
+            '_fck_': _compact_fck,
+            '_in_db_': _compact_in_db,
+        }
+        for k in cls.COLUMNS:
+            ns[k] = CompactAccessor(cls.__dict__[k])
+
+        C = type(cls.__name__, (cls,), ns)
+
+        def instantiate(k2i, vs, fck, fc):
+            r = object.__new__(C)
+            r._k2i = k2i
+            r._dbvs = vs
+            if fck and fck not in fc:
+                fc[fck] = r
+            else:
+                fck = None
+            r._fck = fck
+            return r
+        cls.instantiate = C.instantiate = staticmethod(instantiate)
 
     @classmethod
     def as_(cls, as_):
@@ -176,11 +296,58 @@ class Model(ModelClass('ModelClass', (), {})):
             'creator' if k == cls.CREATED_BY else \
             'updater' if k == cls.UPDATED_BY else None
 
+    @classmethod
+    def bulk_update(cls, records, columns=None, *, per=1000, **kw):
+        pk = cls.PRIMARY_KEY or die.no_pk(cls)
+        g2xs = {}
+        n = 0
+        for r in records:
+            txn = r.is_changed(*(columns or ()), txn={})
+            if not (txn or kw.get('force')):
+                continue
+            d = r.__dict__
+            w = r.pk_dict_in_db(d)
+            upd = r._update_txn_(d, txn, w, kw)
+            if upd is None:
+                r.errors.add(None, r.errors.CONFLICT)
+            elif not upd:
+                pass
+            elif len(pk) > 1 or any(isinstance(v, SQL) for v in upd.values()):
+                # one at a time, but still only the columns asked for
+                if r.query().where(**w).update(**upd).execute():
+                    n += r._after_update_(d, txn, kw)
+                elif r.LOCK_VERSION in w:
+                    r.errors.add(None, r.errors.CONFLICT)
+            else:
+                g2xs.setdefault((tuple(w), tuple(upd)), []).append(
+                    (r, d, txn, (*w.values(), *upd.values())))
+
+        db = cls.DB
+        for (wks, ks), xs in g2xs.items():
+            for i in range(0, len(xs), per):
+                _xs = xs[i:i + per]
+                ids = db.bulk_update(
+                    cls.DB_TABLE, (*wks, *ks), [x[3] for x in _xs], len(wks))
+                db.bump_tables(cls.DB_TABLE)
+                for r, d, txn, vs in _xs:
+                    if vs[0] in ids:
+                        n += r._after_update_(d, txn, kw)
+                    elif len(wks) > 1:  # LOCK_VERSION
+                        r.errors.add(None, r.errors.CONFLICT)
+        return n
+
     @classmethod
     def bulk_loader(cls, columns=None, **kw):
+        'upsert' in kw and kw.setdefault('conflict', cls.PRIMARY_KEY)
         return cls.BulkLoader(
             cls.DB, cls.DB_TABLE, columns or tuple(cls.COLUMNS), **kw)
 
+    @classmethod
+    def copy_loader(cls, columns=None, **kw):
+        cs = columns or tuple(cls.COLUMNS)
+        return cls.CopyLoader(cls.DB, cls.DB_TABLE, cs, py2dbs=[
+            cls.COLUMNS[k].py2db for k in cs], **kw)
+
     @classmethod
     def create_index_sqls(cls):
         t = cls.DB_TABLE
@@ -244,14 +411,139 @@ class Model(ModelClass('ModelClass', (), {})):
                     v = kw[k] = c.form2py(v)
                     if not isinstance(v, pt):
                         return
-        fc = wpk and cls.DB.find_cache
-        r = fc.get((cls.DB_TABLE, *(kw[k] for k in pk))) if fc else None
-        return r if r is not None else \
-            cls.query().where(**kw).peek() if wpk else \
-            cls.query().where(**kw).first()
+        fc = cls.DB.find_cache
+        if wpk:
+            r = None if fc is None else \
+                fc.get((cls.DB_TABLE, *(kw[k] for k in pk)))
+            return r if r is not None else cls.query().where(**kw).peek()
+
+        uk = fc is not None and len(kw) == 1 and cls._unique_key_(kw)
+        if not uk:
+            return cls.query().where(**kw).first()
+        r = fc.get(uk)
+        if r is not None and r._fck_() is not None and \
+           r._in_db_(uk[1]) == uk[2]:
+            return r
+        r = cls.query().where(**kw).peek()
+        if r is not None and r._fck_() is not None:
+            fc[uk] = r  # alive while its primary key entry is
+        return r
+
+    @classmethod
+    def find_many(cls, ids, *, per=1000, skip=False):
+        pk = cls.PRIMARY_KEY or die.no_pk(cls)
+        cs = tuple(cls.COLUMNS[k] for k in pk)
+        fc = cls.DB.find_cache
+        t = cls.DB_TABLE
+        i2r = {}
+        ks = []
+        for id in ids:
+            k = id if len(pk) > 1 else (id,)
+            len(k) == len(pk) or die.n_args(
+                f'{cls}.find_many()', len(pk), 'p', len(k))
+            any(isinstance(v, SQL) and die(TypeError(v)) for v in k)
+            k = tuple(v if v is None or isinstance(v, c.PY_TYPE) else
+                      c.form2py(v) for c, v in zip(cs, k))
+            ks.append(k)
+            if k in i2r or None in k or \
+               not all(isinstance(v, c.PY_TYPE) for c, v in zip(cs, k)):
+                continue
+            i2r[k] = None if fc is None else fc.get((t, *k))
+
+        xs = [k for k, r in i2r.items() if r is None]
+        for i in range(0, len(xs), per):
+            _xs = xs[i:i + per]
+            q = cls.query()
+            if len(pk) == 1:
+                q = q.where(**{pk[0]: IN(*(k[0] for k in _xs))})
+            else:
+                ps = '(' + ', '.join(('%s',) * len(pk)) + ')'
+                q = q.where(SQL(
+                    f"({', '.join(pk)}) IN ({', '.join((ps,) * len(_xs))})",
+                    *(v for k in _xs for v in k)))
+            for r in q._iter_rows(True):
+                i2r[tuple(getattr(r, k) for k in pk)] = r
+
+        rs = [i2r.get(k) for k in ks]
+        if None in rs and not skip:
+            raise RecordNotFound(t, *(
+                id for id, r in zip(ids, rs) if r is None))
+        return [r for r in rs if r is not None]
 
     instantiate = _instantiate_
 
+    @classmethod
+    def insert_graph(cls, records, *, per=1000, **kw):
+        from .relations import BelongsTo, Relation
+
+        # BELONGS_TO takes its value from an assigned parent once that one
+        # has its id (txn_value), so only the order of the inserts matters
+        rs = [*records]
+        r2ps = {}
+        for r in rs:
+            if id(r) in r2ps:
+                continue
+            d = r.__dict__
+            ps = r2ps[id(r)] = []
+            for rel in r.ATTRS.values():
+                if not (isinstance(rel, Relation) and rel.name in d):
+                    continue
+                b2 = isinstance(rel, BelongsTo)
+                if b2 or rel.reverse_b2:
+                    x = d[rel.name]
+                    xs = (x,) if isinstance(x, Model) else \
+                        x if isinstance(x, (list, tuple)) else ()
+                    b2 and ps.extend(xs)
+                    rs.extend(xs)
+
+        r2l = {}
+
+        def level(r):
+            k = id(r)
+            n = r2l.get(k)
+            if n is None:
+                r2l[k] = False
+                n = r2l[k] = max((level(p) + 1 for p in r2ps[k]
+                                  if p.is_new_record()), default=0)
+            elif n is False:
+                die(f'{r!r}: cyclic BELONGS_TO')
+            return n
+
+        g2rs = {}
+        for r in {id(r): r for r in rs}.values():
+            if r.is_new_record():
+                g2rs.setdefault((level(r), type(r)), []).append(r)
+        return sum(m.insert_many(g2rs[n, m], per=per, **kw)
+                   for n, m in sorted(g2rs, key=lambda g: g[0]))
+
+    @classmethod
+    def insert_many(cls, records, *, per=1000, **kw):
+        ai = cls.AUTO_INCREMENT
+        db = cls.DB
+        t = cls.DB_TABLE
+        k2xs = {}
+        for r in records:
+            txn = r.is_changed(txn={})
+            k2xs.setdefault(tuple(txn), []).append((r, txn))
+
+        for ks, xs in k2xs.items():
+            p = f"({', '.join(('%s',) * len(ks))})"
+            for i in range(0, len(xs), per):
+                _xs = xs[i:i + per]
+                sql = (f"INSERT INTO {t} ({', '.join(ks)}) VALUES "
+                       f"{', '.join((p,) * len(_xs))}")
+                vs = [v for r, txn in _xs for v in txn.values()]
+                if ai and ai not in ks:
+                    ids = db.execute_insert_many(sql, vs, ai, len(_xs))
+                    for (r, txn), id in zip(_xs, ids):
+                        txn[ai] = id
+                else:
+                    db.execute(sql, vs)
+                db.bump_tables(t)
+                for r, txn in _xs:
+                    r._after_insert_(r.__dict__, txn, kw)
+        return sum(len(xs) for xs in k2xs.values())
+
     @classmethod
     def query(cls, as_=None):
         if as_ is None:
@@ -355,6 +647,13 @@ class Model(ModelClass('ModelClass', (), {})):
                 fc[fck] = self
         return 1
 
+    def _fck_(self, pop=False):
+        d = self.__dict__
+        return d.pop('.fck', None) if pop else d.get('.fck')
+
+    def _in_db_(self, k):
+        return _attr_in_db(None, self, None, self.COLUMNS[k], _NX)
+
     @cached_property
     def _items_(self):
         return {}
@@ -392,6 +691,14 @@ class Model(ModelClass('ModelClass', (), {})):
 
         return {**txn, **upd} if upd else txn
 
+    def adelete(self, **kw):
+        db = self.DB
+        return (db.aio or die.no_aio(db)).run(self.delete, **kw)
+
+    def asave(self, **kw):
+        db = self.DB
+        return (db.aio or die.no_aio(db)).run(self.save, **kw)
+
     def attr_in_db(self, k):
         return _attr_in_db(None, self, None, self.COLUMNS[k])
 
@@ -446,6 +753,7 @@ class Model(ModelClass('ModelClass', (), {})):
             txn[ai] = self.DB.execute_insert(sql, tuple(txn.values()), ai)
         else:
             self.DB.execute(sql, tuple(txn.values()))
+        self.DB.bump_tables(self.DB_TABLE)
         return self._after_insert_(self.__dict__, txn, kw)
 
     def is_changed(self, *ks, txn=False):
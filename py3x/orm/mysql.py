@@ -1,9 +1,11 @@
-from ..utils import IRANGE, IRANGE_U, \
-    cached_class_property, cached_property, include
+from ..utils import IRANGE, IRANGE_U, cached_class_property, include
 from . import columns, database
 from .columns import BELONGS_TO, BOOL, DATE, DATETIME, VARCHAR  # noqa
 from .model import Model, NOW, TODAY  # noqa
 from .relations import HasMany, HasOne  # noqa
+import os
+import re
+import threading
 import zlib
 
 
@@ -109,6 +111,8 @@ class LONGZTEXT(LONGTEXT):
 
 
 class Database(database.Database):
+    RE_DUPLICATES = re.compile(r'Duplicates: (\d+)')
+
     @cached_class_property
     def CONV(cls):
         from MySQLdb.constants import FIELD_TYPE
@@ -119,33 +123,146 @@ class Database(database.Database):
         c[FIELD_TYPE.TIMESTAMP] = cls.Util.DateTime.from_db
         return c
 
+    def autocommit(self, con):
+        return con.get_autocommit()
+
     def connect(self, **kw):
         kw.setdefault('conv', self.CONV)
         from MySQLdb import connect
         return connect(**kw)
 
+    def copy_rows(self, table, columns, rows):
+        # LOAD DATA LOCAL INFILE reads a path: stream through a named pipe
+        import tempfile
+        f = database.CopyStream(rows)
+        d = tempfile.mkdtemp()
+        p = os.path.join(d, 'rows')
+        os.mkfifo(p)
+        es = []
+
+        def write():
+            try:
+                with open(p, 'wb') as w:
+                    for b in iter(lambda: f.read(65536), b''):
+                        w.write(b)
+            except BaseException as e:
+                es.append(e)
+
+        t = threading.Thread(target=write, name='py3x-load-data')
+        t.start()
+        try:
+            self.execute(
+                f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} "
+                f"CHARACTER SET binary ({', '.join(columns)})", (p,), int)
+        finally:
+            if t.is_alive():  # the server stopped reading: drain the writer
+                f.rows = iter(())
+                fd = os.open(p, os.O_RDONLY | os.O_NONBLOCK)
+                try:
+                    while t.is_alive():
+                        try:
+                            os.read(fd, 65536) or t.join(0.01)
+                        except BlockingIOError:
+                            t.join(0.01)
+                finally:
+                    os.close(fd)
+            t.join()
+            os.unlink(p)
+            os.rmdir(d)
+        if es:
+            raise es[0]
+        return f.count
+
+    def count_estimate(self, sql, table=None):
+        csr = self.execute(*sql.wrap('EXPLAIN %s'), tuple)
+        hs = tuple(d[0] for d in csr.description)
+        ir = hs.index('rows')
+        i_f = hs.index('filtered') if 'filtered' in hs else None
+        n = 1
+        for r in csr:
+            n *= (r[ir] or 0) * ((100 if i_f is None else r[i_f]) / 100)
+        return int(n)
+
     def execute_insert(self, sql, vs, ai):
         return self.execute(sql, vs, tuple).lastrowid
 
-    @cached_property
-    def quote(self):
-        e = self._con.escape
-        lt = self._con.literal
-
-        def quote(v):
-            if isinstance(v, bytes):
-                return '0x' + v.hex()
-            x = e(v.encode()) if isinstance(v, str) else lt(v)
-            return x.decode() if isinstance(x, bytes) else x
-
-        return quote
+    def execute_insert_many(self, sql, vs, ai, n):
+        # a multi-row VALUES gets consecutive ids unless the lock mode is 2
+        # (interleaved) and a bulk INSERT ... SELECT runs on the same table
+        with self.checkout():
+            id = self.execute(sql, vs, tuple).lastrowid
+            step = self.server_var('auto_increment_increment')
+        return range(id, id + n * step, step)
+
+    def execute_sets(self, items):
+        sqls = self._set_sqls(items)
+        if len(sqls) < 2:
+            return super().execute_sets(items)
+
+        with self.checkout():
+            con = self._con
+            con.set_server_option(0)  # MYSQL_OPTION_MULTI_STATEMENTS_ON
+            try:
+                csr = self.execute(';\n'.join(x._t[0] for x in sqls),
+                                   [v for x in sqls for v in x._t[1]], tuple)
+                rss = [database.CachedCursor(csr.description, [*csr])]
+                while csr.nextset():
+                    rss.append(database.CachedCursor(csr.description, [*csr]))
+            finally:
+                con.set_server_option(1)  # MYSQL_OPTION_MULTI_STATEMENTS_OFF
+        return self._sets(items, rss)
+
+    def max_packet(self):
+        with self.checkout():
+            return self.server_var('max_allowed_packet')
+
+    def ping(self, con):
+        con.ping()
+
+    def quote(self, v):
+        if isinstance(v, bytes):
+            return '0x' + v.hex()
+        with self.checkout():  # never keep a pooled connection for this
+            con = self._con
+            x = con.escape(v.encode()) if isinstance(v, str) else \
+                con.literal(v)
+        return x.decode() if isinstance(x, bytes) else x
 
     def reset(self):
         x = self.execute
-        x('SET foreign_key_checks=0')
-        for s in x('SHOW TABLE STATUS'):
-            x('DROP %s %s' % (s[-1] or 'TABLE', s[0]))
-        db = self.con_kw['database']
-        for s in x('SHOW FUNCTION STATUS WHERE Db = %s', (db,)):
-            x('DROP %s %s' % (s[2], s[1]))
-        x('SET foreign_key_checks=1')
+        with self.checkout():  # session variable
+            x('SET foreign_key_checks=0')
+            for s in x('SHOW TABLE STATUS'):
+                x('DROP %s %s' % (s[-1] or 'TABLE', s[0]))
+            db = self.con_kw['database']
+            for s in x('SHOW FUNCTION STATUS WHERE Db = %s', (db,)):
+                x('DROP %s %s' % (s[2], s[1]))
+            x('SET foreign_key_checks=1')
+
+    def server_var(self, k):  # once per connection
+        con = self._con
+        k2v = getattr(con, 'server_vars', None)
+        if k2v is None:
+            k2v = con.server_vars = {}
+        if k not in k2v:
+            k2v[k] = self.execute(f'SELECT @@{k}', (), 1)[0]
+        return k2v[k]
+
+    def stream_cursor(self, size):
+        from MySQLdb.cursors import SSCursor
+        return self._con.cursor(SSCursor)
+
+    def upsert_counts(self, csr, n, upsert):
+        if not upsert:
+            return csr.rowcount, 0
+        # Records: n  Duplicates: d  Warnings: w; affected = 1/2/0 per
+        # inserted/updated/unchanged row. No info for a single row
+        m = self.RE_DUPLICATES.search(self._con.info() or '')
+        i = n - int(m[1]) if m else int(n == 1 and csr.rowcount == 1)
+        return i, (csr.rowcount - i) // 2
+
+    def upsert_sql(self, table, columns, upsert, conflict=(),
+                   changed_only=False):  # MySQL counts changed rows only
+        return 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'{k} = VALUES({k})' for k in upsert) if upsert else \
+            f'ON DUPLICATE KEY UPDATE {columns[0]} = {columns[0]}'
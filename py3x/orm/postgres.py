@@ -1,8 +1,9 @@
-from ..utils import cached_class_property, cached_property, include
-from . import columns, database, query
+from ..utils import cached_class_property, include
+from . import ANY, columns, database, die, query
 from .columns import BELONGS_TO, BOOL, DATE, INT, TEXT, VARCHAR  # noqa
 from .model import Model, NOW, TODAY  # noqa
 from .relations import HasMany, HasOne  # noqa
+from itertools import count
 
 
 class BIGINT(INT):
@@ -71,9 +72,15 @@ class PgQuery(query.Query):
     def delete(self):
         return self._clone({**self.kw, 'type': 'DELETE'})
 
+    def where_in(self, *args, **kw):
+        len(kw) == 1 or die.n_args('where_in()', 1, 'k', len(kw))
+        (k, vs), = kw.items()
+        return self.where(*args, **{k: ANY(vs)})
+
 
 class Database(database.Database):
     Query = PgQuery
+    STREAM_SEQ = count(1)
 
     @cached_class_property
     def STRING_TYPES(cls):
@@ -84,19 +91,55 @@ class Database(database.Database):
             i2t[i] = new_type((i,), dt.__name__, dt.from_db)
         return i2t
 
+    def autocommit(self, con):
+        return con.autocommit
+
+    def bulk_update(self, table, ks, rs, nw=1):
+        # typed by the table's own columns through the UNION
+        xs = ', '.join(f'{k} AS k{i}' for i, k in enumerate(ks))
+        ss = ', '.join(f'{k} = v.k{i}' for i, k in enumerate(ks) if i >= nw)
+        ws = ' AND '.join(f'{table}.{k} = v.k{i}'
+                          for i, k in enumerate(ks[:nw]))
+        p = '(' + ', '.join(('%s',) * len(ks)) + ')'
+        return {x[0] for x in self.execute(
+            f"UPDATE {table} SET {ss} FROM (SELECT {xs} FROM {table} "
+            f"WHERE FALSE UNION ALL VALUES {', '.join((p,) * len(rs))}) v "
+            f"WHERE {ws} RETURNING v.k0", [v for r in rs for v in r], tuple)}
+
     def connect(self, **kw):
         from psycopg2 import connect
         con = connect(**kw)
         con.string_types.update(self.STRING_TYPES)
         return con
 
+    def copy_rows(self, table, columns, rows):
+        f = database.CopyStream(rows, lambda v: b'\\\\x' + v.hex().encode())
+        with self.checkout():
+            csr = self._con.cursor()
+            csr.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN", f)
+            self.pool is None or self._keep_write(csr)
+        return f.count
+
+    def count_estimate(self, sql, table=None):
+        if table:
+            n = self.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                (table,), 1)[0]
+            if n >= 0:  # -1 => never vacuumed nor analyzed
+                return int(n)
+        x = self.execute(*sql.wrap('EXPLAIN (FORMAT JSON) %s'), 1)[0]
+        return int(x[0]['Plan']['Plan Rows'])
+
     def execute_insert(self, sql, vs, ai):
         return self.execute(f'{sql} RETURNING {ai}', vs, 1)[0]
 
-    @cached_property
-    def quote(self):
-        m = self._con.cursor().mogrify
-        return lambda v: m('%s', (v,)).decode()
+    def execute_insert_many(self, sql, vs, ai, n):
+        return [x[0] for x in self.execute(f'{sql} RETURNING {ai}', vs, tuple)]
+
+    def quote(self, v):
+        with self.checkout():  # never keep a pooled connection for this
+            return self._con.cursor().mogrify('%s', (v,)).decode()
 
     def reset(self):
         x = self.execute
@@ -111,3 +154,27 @@ class Database(database.Database):
                 x(f'DROP TABLE {t} CASCADE')
             for p, in x(ps):
                 x(f'DROP FUNCTION {p} CASCADE')
+
+    def stream_cursor(self, size):
+        csr = self._con.cursor(f'py3x_stream_{next(self.STREAM_SEQ)}')
+        csr.itersize = size
+        return csr
+
+    def upsert_counts(self, csr, n, upsert):
+        if not upsert:
+            return csr.rowcount, 0
+        i = sum(1 for x, in csr if x)
+        return i, csr.rowcount - i
+
+    def upsert_sql(self, table, columns, upsert, conflict=(),
+                   changed_only=False):
+        c = f" ({', '.join(conflict)})" if conflict else ''
+        if not upsert:
+            return f'ON CONFLICT{c} DO NOTHING'
+        c or die(TypeError('ON CONFLICT DO UPDATE needs conflict columns'))
+        w = changed_only and ' WHERE (%s) IS DISTINCT FROM (%s)' % (
+            ', '.join(f'{table}.{k}' for k in upsert),
+            ', '.join(f'EXCLUDED.{k}' for k in upsert))
+        return (f'ON CONFLICT{c} DO UPDATE SET ' +
+                ', '.join(f'{k} = EXCLUDED.{k}' for k in upsert) +
+                (w or '') + ' RETURNING (xmax = 0)')  # xmax = 0: inserted
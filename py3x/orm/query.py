@@ -1,8 +1,114 @@
-from . import Operator, SQL, die
-from ..utils import _NX, cached_class_property, include, qw, repr_kw, try_
+from . import GT, IN, LE, BulkLoader, Operator, SQL, die
+from ..utils import _NX, AsJsonEncoder, cached_class_property, include, qw, \
+    repr_kw, try_
+from .columns import BLOB, TEXT
 from .model import ModelClass
 from .relations import Relation
+from array import array
+from collections import namedtuple
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from itertools import count, islice
+import json
 import re
+import time
+
+
+class KeysetPaginate:
+    def _keyset_cols(self):
+        as_ = self.as_
+        m = self.model
+        match = self.RE_ORDER_BY.match
+        ks = []
+        for x in (self.kw.get('order_by') or ()):
+            t = x[0] if x.__class__ is tuple else die(TypeError(
+                'keyset pagination does not support %r' % (x,)))
+            t == as_ or die(TypeError('keyset column must be on %r' % as_))
+            k = match(x[1]).group(3)
+            m.COLUMNS[k].null and die(TypeError(  # NULL never compares
+                'keyset column must be NOT NULL: %r' % k))
+            ks.append((k, x[1][len(k):].strip().upper() == 'DESC'))
+        ns = {k for k, d in ks}
+        ks.extend((k, False) for k in (m.PRIMARY_KEY or die.no_pk(m))
+                  if k not in ns)
+        return tuple(ks)
+
+    def _keyset_decode(self, ks, cursor):
+        x = json.loads(urlsafe_b64decode(cursor.encode()))
+        len(x) == len(ks) + 1 or die(ValueError(cursor))
+        cs = self.model.COLUMNS
+        vs = []
+        for (k, d), v in zip(ks, x[1:]):
+            c = cs[k]
+            if v is not None and not isinstance(v, c.PY_TYPE):
+                v = c.form2py(v)
+                isinstance(v, c.PY_TYPE) or die(ValueError(cursor))
+            vs.append(v)
+        return bool(x[0]), vs
+
+    def _keyset_encode(self, ks, prev, r):
+        d = r.__dict__
+        k2i = d['.k2i']
+        dbvs = d['.dbvs']
+        vs = [dbvs[k2i[k]] if k in k2i else die.col_nld(k) for k, _ in ks]
+        return urlsafe_b64encode(json.dumps(
+            [int(prev), *vs], cls=AsJsonEncoder, separators=(',', ':'),
+        ).encode()).decode()
+
+    def _keyset_trim(self, rs):
+        pp, ks, prev, cursor = self.kw['keyset']
+        more = len(rs) > pp
+        more and rs.pop()
+        prev and rs.reverse()
+        self._keyset = (
+            rs and (more if prev else cursor) and
+            self._keyset_encode(ks, True, rs[0]) or None,
+            rs and (cursor if prev else more) and
+            self._keyset_encode(ks, False, rs[-1]) or None)
+
+    def _keyset_where(self, ks, vs, prev):
+        p = self.as_ + '.' if self.as_ and 'join' in self.kw else ''
+        ops = tuple('<' if d != prev else '>' for k, d in ks)
+        if len(set(ops)) == 1:
+            cs = ', '.join(p + k for k, d in ks)
+            ps = ', '.join(('%s',) * len(ks))
+            return SQL(f'({cs}) {ops[0]} ({ps})' if len(ks) > 1 else
+                       f'{cs} {ops[0]} {ps}', *vs)
+
+        ss = []
+        xs = []
+        for i, (k, d) in enumerate(ks):
+            ss.append('(' + ' AND '.join((
+                *(f'{p}{_k} = %s' for _k, _ in ks[:i]),
+                f'{p}{k} {ops[i]} %s')) + ')')
+            xs.extend(vs[:i + 1])
+        return SQL('(' + ' OR '.join(ss) + ')', *xs)
+
+    @property
+    def next_cursor(self):
+        'keyset' in self.kw or die.no_page_after()
+        self.cache()
+        return self._keyset[1]
+
+    def page_after(self, cursor=None, per_page=None):
+        m = self.model
+        pp = per_page and try_(lambda: int(per_page)) or m.PER_PAGE
+        pp = min(max(pp, 1), m.MAX_PER_PAGE)
+        ks = self._keyset_cols()
+        x = cursor and try_(lambda: self._keyset_decode(ks, cursor))
+        prev = bool(x and x[0])
+        q = self.where(self._keyset_where(ks, x[1], prev)) if x else self
+        p = self.as_ and self.as_ + '.'
+        q = q.order_by(*(f'{p}{k} {"ASC" if d == prev else "DESC"}'
+                         for k, d in ks))
+        return q._clone({
+            **q.kw, 'limit': pp + 1, 'keyset': (pp, ks, prev, bool(x)),
+        }, 'offset', 'page').cache(True)
+
+    @property
+    def prev_cursor(self):
+        'keyset' in self.kw or die.no_page_after()
+        self.cache()
+        return self._keyset[0]
 
 
 class Paginate:
@@ -32,7 +138,9 @@ class Paginate:
     def last_page(self):
         pp = self.per_page
         tc = self.total_count
-        return int((tc - 1) / pp) + 1 if tc else 1
+        lp = int((tc - 1) / pp) + 1 if tc else 1
+        st = (self.kw.get('count') or (self.model.COUNT_STRATEGY,))[0]
+        return lp if st == 'exact' else max(lp, self.current_page)
 
     def page(self, current_page, per_page=None):
         m = self.model
@@ -70,10 +178,77 @@ def _always(fn):
     return fn
 
 
+def _shape_xs(xs, vs):
+    ks = []
+    for x in xs:
+        t = x.__class__
+        if t is tuple and len(x) == 3:
+            v = x[2]
+            if isinstance(v, SQL):
+                _s, _vs = v._t
+                _vs and vs.extend(_vs)
+                x = (x[0], x[1], _s)
+            else:
+                vs.append(v)
+                x = (x[0], x[1], _NX)
+        elif isinstance(x, SQL):
+            _s, _vs = x._t
+            _vs and vs.extend(_vs)
+            x = (_s,)
+        ks.append(x)
+    return tuple(ks)
+
+
+class ColumnArrays(dict):
+    def __init__(self, ks, xs, ms):
+        super().__init__(zip(ks, xs))
+        self.masks = dict(zip(ks, ms))
+
+
+class StatementCache(dict):
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+
+    def add(self, k, s):
+        len(self) >= self.maxsize and self.pop(next(iter(self), None), None)
+        self[k] = s
+
+    def clear(self):
+        super().clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self), maxsize=self.maxsize)
+
+
+class Stream:
+    __slots__ = ('query', 'size')
+
+    def __init__(self, query, size):
+        self.query = query
+        self.size = size
+
+    def __aiter__(self):
+        q = self.query
+        db = q.model.DB
+        return (db.aio or die.no_aio(db)).iterate(
+            q._iter_rows(None, self.size), self.size)
+
+    def __iter__(self):
+        return self.query._iter_rows(None, self.size)
+
+
 class Query:
+    include(KeysetPaginate)
     include(Paginate)
-    __slots__ = qw('model as_ kw _cache _total_count')
+    __slots__ = qw('model as_ kw _cache _keyset _total_count')
     BORDER = "'|'"
+    COUNT_STRATEGIES = qw('exact cached approximate')
+    IN_MAX = 1000
+    IN_SEQ = count(1)
+    IN_TEMP_MIN = 10000
     RE_ORDER_BY = re.compile(
         r'\A(?:(\w+)\.)?((\w+)(?: +(?:ASC|DESC))?)\Z', re.IGNORECASE)
     RE_TA = re.compile(r'[A-Za-z_][0-9A-Za-z_]*')
@@ -87,6 +262,14 @@ class Query:
     def BUILD_CACHE(cls):
         return {}
 
+    @cached_class_property
+    def ROW_CLASSES(cls):
+        return {}
+
+    @cached_class_property
+    def STATEMENT_CACHE(cls):
+        return StatementCache()
+
     @classmethod
     def _assert_ta(cls, ta):
         if not (isinstance(ta, str) and cls.RE_TA.fullmatch(ta)):
@@ -151,17 +334,32 @@ class Query:
             cls = self.__class__
             kfs = ((k, getattr(cls, '_build_' + k)) for k in getattr(cls, t))
             kfas = cls.BUILD_CACHE[t] = tuple(
-                (k, f, getattr(f, '_always', None)) for k, f in kfs)
+                (k, f, getattr(f, '_always', None),
+                 getattr(cls, '_shape_' + k, None)) for k, f in kfs)
 
-        ss = []
-        vs = []
         kw = self.kw
         if wp is None:
             wp = 'join' in kw
-        for k, f, a in kfas:
+        sc = self.STATEMENT_CACHE
+        sk = sc.maxsize and self._shape(t, wp, kfas)
+        if sk:
+            sk, svs = sk
+            s = sc.get(sk)
+            if s:
+                sc.hits += 1
+                return SQL(s, *svs)
+            sc.misses += 1
+
+        ss = []
+        vs = []
+        for k, f, a, _ in kfas:
             i = k in kw or None
             (a or i) and f(self, ss, vs, wp, i and kw[k])
-        return SQL(' '.join(ss), *vs)
+        s = ' '.join(ss)
+        if sk:
+            sc.add(sk, len(vs) == len(svs) and
+                   all(v is sv for v, sv in zip(vs, svs)) and s)
+        return SQL(s, *vs)
 
     @_always
     def _build_delete(self, ss, vs, wp, ts):
@@ -229,6 +427,52 @@ class Query:
                 self._add2(ss, vs, wp, None, *ws)
             self._add2(ss, vs, wp, None, *wss[1])
 
+    def _shape(self, t, wp, kfas):
+        kw = self.kw
+        vs = []
+        ks = [self.__class__, self.model, self.as_, t, wp]
+        for k, f, a, sh in kfas:
+            if k in kw:
+                if sh is None:
+                    return
+                ks.append((k, sh(self, vs, kw[k])))
+        return tuple(ks), vs
+
+    def _shape_delete(self, vs, ts):
+        return ts
+
+    def _shape_for_update(self, vs, x):
+        return bool(x)
+
+    def _shape_from(self, vs, x):
+        return _shape_xs((x,), vs)
+
+    _shape_group_by = _shape_having = _shape_from
+
+    def _shape_join(self, vs, t2j):
+        return tuple((t, j[0], j[1], *_shape_xs((j[2],), vs), *j[3:])
+                     for t, j in t2j.items())
+
+    def _shape_limit(self, vs, x):
+        vs.append(x)
+        return True
+
+    def _shape_offset(self, vs, x):
+        x and vs.append(x)
+        return bool(x)
+
+    def _shape_order_by(self, vs, xs):
+        return _shape_xs(xs, vs)
+
+    def _shape_select(self, vs, t2xs):
+        return tuple((t, _shape_xs(xs, vs)) for t, xs in t2xs.items())
+
+    _shape_set = _shape_order_by
+
+    def _shape_where(self, vs, wss):
+        return tuple(_shape_xs(ws, vs) for ws in wss[0]), \
+            _shape_xs(wss[1], vs)
+
     def _clone(self, kw, *dks):
         q = object.__new__(self.__class__)
         q.model = self.model
@@ -247,6 +491,37 @@ class Query:
         m.__qualname__ = 'Query.' + (qn or k)
         return m
 
+    def _count_total(self):
+        m = self.model
+        st, ttl = self.kw.get('count') or (m.COUNT_STRATEGY, None)
+        if st == 'exact' or 'in_chunks' in self.kw:  # summed per chunk
+            return self.count()
+        if st == 'cached':
+            return m.DB.count_cached(self.count_sql(), ttl or m.COUNT_TTL)
+        if st == 'approximate':
+            t = not any(k in self.kw for k in self.SELECT_) and m.DB_TABLE
+            return m.DB.count_estimate(
+                self._build('SELECT_').wrap('SELECT 1 %s'), t or None)
+        die(TypeError('unknown count strategy: %r' % st))
+
+    def _cursor(self, size=None):
+        db = self.model.DB
+        ttl = self.kw.get('cached')
+        sql = self._build('SELECT')
+        if 'for_update' in self.kw:  # locks are taken on the primary
+            return db.stream(*sql, size) if size else db.execute(*sql, tuple)
+        return db.read_stream(*sql, size) if size else \
+            db.read(*sql, tuple) if ttl is None and db.request_memo is None \
+            else db.execute_cached(*sql, self._tables(), ttl)
+
+    def _db2pys(self, hs):
+        ms = [m for t, m in self._iter_tms()]
+        fs = []
+        for h in hs:
+            f = next((m.COLUMNS[h].db2py for m in ms if h in m.COLUMNS), None)
+            fs.append(f if f and f is not True else None)
+        return any(fs) and tuple((i, f) for i, f in enumerate(fs) if f)
+
     def _db_table(self):
         t = self.model.DB_TABLE
         as_ = self.as_
@@ -285,10 +560,9 @@ class Query:
 
         return fis, jkis
 
-    def _iter_rows(self, peek=None):
+    def _hydrate(self, csr, peek=None):
         db = self.model.DB
         fc = peek and db.find_cache
-        csr = db.execute(*self._build('SELECT'), tuple)
         t2xs = self.kw.get('select')
         if not t2xs or len(t2xs) == 1:
             t = next(iter(t2xs)) if t2xs else self.as_
@@ -330,6 +604,48 @@ class Query:
             if rs[0] is not None:
                 yield rs[0]
 
+    def _in_queries(self):
+        kw = self.kw
+        t, k, vs, ph = kw['in_chunks']
+        wss = kw['where']
+
+        def q(op):
+            def rep(xs):
+                return tuple((x[0], x[1], op) if x.__class__ is tuple and
+                             len(x) == 3 and x[2] is ph else x for x in xs)
+            return self._clone({**kw, 'where': (
+                tuple(rep(ws) for ws in wss[0]), rep(wss[1]))}, 'in_chunks')
+
+        per = self.IN_MAX
+        if len(vs) < self.IN_TEMP_MIN and \
+           not any(x in kw for x in ('order_by', 'limit', 'offset')):
+            for i in range(0, len(vs), per):
+                yield q(IN(*vs[i:i + per]))
+            return
+
+        db = self.model.DB
+        c = next(self._iter_tms(t))[1].COLUMNS[k]
+        d = f'v {c.db_type()}'  # TEXT/BLOB: keyed by a prefix, not unique
+        d += ', KEY (v(255))' if isinstance(c, (BLOB, TEXT)) else \
+            ' PRIMARY KEY'
+        tt = f'py3x_in_{next(self.IN_SEQ)}'
+        with db.checkout():  # temporary tables are per connection
+            db.execute(f'CREATE TEMPORARY TABLE {tt} ({d})')
+            try:
+                BulkLoader(db, tt, ('v',), per=per).extend(
+                    (v,) for v in vs).execute()
+                yield q(IN(SQL(f'SELECT v FROM {tt}')))
+            finally:
+                db.execute(f'DROP TEMPORARY TABLE {tt}')
+
+    def _iter_rows(self, peek=None, size=None):
+        if 'in_chunks' in self.kw:
+            for q in self._in_queries():
+                yield from q._iter_rows(peek, size)
+            return
+
+        yield from self._hydrate(self._cursor(size), peek)
+
     def _iter_tms(self, k=None):
         if k is None:
             yield (self.as_, self.model)
@@ -353,6 +669,52 @@ class Query:
         t or die.no_ta(m)
         return t, m.ATTRS[k]
 
+    def _loaded(self, rs):
+        'keyset' in self.kw and self._keyset_trim(rs)
+        'preload' in self.kw and self._preload(rs)
+        return rs
+
+    def _preload(self, rs):
+        ps = {}
+        for p in self.kw['preload']:
+            ks = p.split('.')
+            for i in range(len(ks)):
+                ps['.'.join(ks[:i + 1])] = None
+
+        p2mrs = {'': (self.model, rs)}
+        for p in sorted(ps, key=lambda p: p.count('.')):
+            h, _, k = p.rpartition('.')
+            m, rs = p2mrs[h]
+            rel = m.ATTRS.get(k)
+            isinstance(rel, Relation) or die.bad_rel(p)
+            p2mrs[p] = (rel.rel_model, rel.preload(rs) if rs else ())
+
+    def _raw(self, db2py, mk):
+        if 'in_chunks' in self.kw:
+            for q in self._in_queries():
+                yield from q._raw(db2py, mk)
+            return
+
+        csr = self._cursor()
+        hs = tuple(d[0] for d in csr.description)
+        f = mk(hs)
+        ifs = db2py and self._db2pys(hs)
+        if not ifs:
+            yield from (csr if f is tuple else map(f, csr))
+            return
+        for vs in csr:
+            vs = [*vs]
+            for i, c in ifs:
+                vs[i] = c(vs[i])
+            yield f(vs)
+
+    def _row_class(self, hs):
+        rcs = self.ROW_CLASSES
+        R = rcs.get(hs)
+        if R is None:
+            R = rcs[hs] = namedtuple('Row', hs, rename=True)
+        return R._make
+
     def _select(self, t2xs, args, kw):
         as_ = self.as_
         t2j = self.kw.get('join') or ()
@@ -394,9 +756,31 @@ class Query:
 
         return self._clone({**self.kw, 'select': t2xs}, 'type')
 
+    def _tables(self):
+        return tuple({m.DB_TABLE: None for t, m in self._iter_tms()})
+
     def _xs_len(self, xs):
         return None if '*' in xs or any(xs.values()) else len(xs)
 
+    def acount(self, one=1):
+        db = self.model.DB
+        return (db.aio or die.no_aio(db)).run(self.count, one)
+
+    def afirst(self):
+        db = self.model.DB
+        return (db.aio or die.no_aio(db)).run(self.first)
+
+    def all(self):
+        db = self.model.DB
+        q = self._clone({**self.kw}).cache(True)
+        return (db.aio or die.no_aio(db)).run(q.cache)
+
+    def cached(self, ttl=None):
+        if ttl is False:
+            return self._clone({**self.kw}, 'cached')
+        return self._clone({
+            **self.kw, 'cached': self.model.CACHE_TTL if ttl is None else ttl})
+
     def cache(self, on=_NX):
         if on is False:
             self._cache = False
@@ -407,7 +791,7 @@ class Query:
             if c is None:
                 c = 'limit' in self.kw
             if c is True:
-                c = self._cache = list(self._iter_rows())
+                c = self._cache = self._loaded(list(self._iter_rows()))
             return c
 
         on is True or on is None or die.type(on, bool, None)
@@ -415,25 +799,115 @@ class Query:
             self._cache = True  # None => discard cache
         return self
 
+    def columns(self, *cols, dtype=None, numpy=False, batch_size=10000):
+        cols or die.n_args('columns()', 'some', 'p', 0)
+        n = len(cols)
+        tcs = (dtype,) * n if dtype is None or isinstance(dtype, str) else \
+            tuple(dtype)
+        len(tcs) == n or die(TypeError(f'dtype must have {n} items'))
+        cs = self.model.COLUMNS
+        tcs = tuple(t or (
+            'q' if x in cs and cs[x].PY_TYPE is int else
+            'b' if x in cs and cs[x].PY_TYPE is bool else 'd')
+            for x, t in zip(cols, tcs))
+        xs = tuple(array(t) for t in tcs)
+        ms = [None] * n
+
+        csr = self.model.DB.read_stream(
+            *self.select(*cols).sql(), batch_size)
+        it = iter(csr)
+        i0 = 0
+        while True:
+            rs = [*islice(it, batch_size)]
+            if not rs:
+                break
+            for i, vs in enumerate(zip(*rs)):
+                m = ms[i]
+                if None in vs:
+                    if m is None:
+                        m = ms[i] = bytearray(i0)
+                    m.extend(v is None for v in vs)
+                    vs = [0 if v is None else v for v in vs]
+                elif m is not None:
+                    m.extend(bytes(len(vs)))
+                xs[i].extend(vs)
+            i0 += len(rs)
+
+        if numpy:
+            import numpy as np
+            xs = tuple(np.frombuffer(x, x.typecode) for x in xs)
+            ms = (m if m is None else np.frombuffer(m, bool) for m in ms)
+        return ColumnArrays(tuple(str(x) for x in cols), xs, ms)
+
     def count(self, one=1):
-        return self.model.DB.execute(*self.count_sql(one), 1)[0]
+        if 'in_chunks' in self.kw:
+            return sum(q.count(one) for q in self._in_queries())
+        return self.model.DB.read(*self.count_sql(one), 1)[0]
 
     def count_sql(self, one=1):
+        'in_chunks' in self.kw and die(TypeError('IN is split into chunks'))
         return self._build('SELECT_').wrap(f'SELECT COUNT({one}) %s')
 
+    def count_strategy(self, strategy, ttl=None):
+        strategy in self.COUNT_STRATEGIES or die(TypeError(
+            'unknown count strategy: %r' % strategy))
+        return self._clone({**self.kw, 'count': (strategy, ttl)})
+
     def delete(self, *ts):
         ts and all(next(self._iter_tms(t)) for t in ts)
         return self._clone({
             **self.kw, 'type': 'DELETE', 'delete': ts or (self.as_,)})
 
+    def dicts(self, db2py=False):
+        return [*self._raw(db2py, lambda hs: lambda vs: dict(zip(hs, vs)))]
+
     def execute(self):
-        return self.model.DB.execute(*self.sql(), int)
+        if 'in_chunks' in self.kw:
+            return sum(q.execute() for q in self._in_queries())
+        db = self.model.DB
+        n = db.execute(*self.sql(), int)
+        'type' in self.kw and db.bump_tables(*self._tables())
+        return n
+
+    def execute_in_batches(self, batch_size=1000, *, after=None,
+                           progress=None, sleep=0):
+        kw = self.kw
+        kw.get('type') or die(TypeError('no update() or delete()'))
+        'limit' in kw and die.incompo(self, 'limit()', 'execute_in_batches()')
+        m = self.model
+        pk = m.PRIMARY_KEY or die.no_pk(m)
+        len(pk) == 1 or die(TypeError(f'{m} has a composite primary key'))
+        db = m.DB
+        db.txn_depth and die('execute_in_batches() inside a transaction')
+        pk = pk[0]
+        t = (self.as_,) if self.as_ else ()
+        o = '.'.join((*t, pk))
+        n = 0
+        while True:  # each chunk ends at the batch_size-th matching key
+            q = self if after is None else self.where(*t, **{pk: GT(after)})
+            x = db.execute(*q._clone(
+                {**q.kw}, 'type', 'set', 'delete', 'order_by').select(pk)
+                .order_by(o).limit(1).offset(batch_size - 1).sql(), 1)
+            hi = x and x[0]
+            if hi is not None:
+                q = q.where(*t, **{pk: LE(hi)})
+            with db.txn_do():
+                _n = q.execute()
+            n += _n
+            progress and progress(hi, _n)  # hi is None after the last chunk
+            if hi is None:
+                return n
+            after = hi
+            sleep and time.sleep(sleep)
 
     def exists(self):
+        if 'in_chunks' in self.kw:
+            return any(q.exists() for q in self._in_queries())
         sql = self._build('SELECT_').wrap('SELECT 1 %s LIMIT 1')
-        return bool(self.model.DB.execute(*sql, 1))
+        return bool(self.model.DB.read(*sql, 1))
 
     def exists_sql(self):
+        'in_chunks' in self.kw and die(TypeError('IN is split into chunks'))
         return self._build('SELECT_').wrap('EXISTS (SELECT 1 %s)')
 
     def first(self):
@@ -549,29 +1023,46 @@ class Query:
         return self._clone({**self.kw, 'order_by': tuple(xs)})
 
     def peek(self):
-        return next(self._iter_rows(True), None)
+        r = next(self._iter_rows(True), None)
+        r is not None and 'preload' in self.kw and self._preload([r])
+        return r
 
     def pluck(self, cols):
         return self.model.DB.pluck(*self.select(SQL(cols)).sql())
 
+    def preload(self, *paths):
+        paths or die.n_args('preload()', 'some', 'p', 0)
+        ps = self.kw.get('preload') or ()
+        return self._clone({**self.kw, 'preload': (*ps, *paths)}).cache(True)
+
+    def rows(self, db2py=False):
+        return [*self._raw(db2py, self._row_class)]
+
     def select(self, *args, **kw):
         args or kw or die.n_args('select()', 'some', 'p/k', 0)
         return self._select({}, args, kw)
 
     def sql(self):
+        'in_chunks' in self.kw and die(TypeError('IN is split into chunks'))
         return self._build(self.kw.get('type') or 'SELECT')
 
+    def stream(self, batch_size=1000):
+        return Stream(self, batch_size)
+
     @property
     def total_count(self):
         c = getattr(self, '_total_count', None)
         if c is None:
-            c = self._total_count = self.count()
+            c = self._total_count = self._count_total()
         return c
 
     @total_count.setter
     def total_count(self, v):
         self._total_count = v
 
+    def tuples(self, db2py=False):
+        return [*self._raw(db2py, lambda hs: tuple)]
+
     def update(self, *args, **kw):
         kw or die.n_args('update()', 'some', 'k', 0)
         if args:
@@ -627,6 +1118,17 @@ class Query:
             sql._t = (f'({_s[6:]})' if wrap else _s[6:], _vs)
         return sql
 
+    def where_in(self, *args, **kw):
+        len(kw) == 1 or die.n_args('where_in()', 1, 'k', len(kw))
+        (k, vs), = kw.items()
+        vs = tuple(dict.fromkeys(vs))
+        if len(vs) <= self.IN_MAX:
+            return self.where(*args, **{k: IN(*vs)})
+        ph = IN()  # placeholder replaced for each chunk
+        q = self.where(*args, **{k: ph})
+        t = next(x[0] for x in q.kw['where'][1] if x[-1] is ph)
+        return q._clone({**q.kw, 'in_chunks': (t, k, vs, ph)})
+
     def with_select(self, *args, **kw):
         args or kw or die.n_args('with_select()', 'some', 'p/k', 0)
         t2xs = self.kw.get('select')
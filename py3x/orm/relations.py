@@ -1,4 +1,4 @@
-from . import SQL, die
+from . import IN, SQL, die
 from .model import _attr_in_db
 from ..utils import cached_property
 import re
@@ -39,6 +39,10 @@ class Relation:
     def __repr__(self):
         return f'{self.model.__name__}.{self.name}'
 
+    @cached_property
+    def _join_sqls(self):
+        return {}
+
     @cached_property
     def _query(self):
         m = self.rel_model
@@ -103,12 +107,47 @@ class Relation:
                 t2 = m2.DB_TABLE_AS if as_ is None else as_
                 if t2 == t1:
                     t2 = ''
-                p2 = t2 and t2 + '.'
-                return m2.as_(t2).where(SQL(' AND '.join(
-                    f'{p2}{c2} = {t1}.{c1}' for c2, c1 in sjs)))
+                k = (t1, t2)
+                s = self._join_sqls.get(k)
+                if s is None:
+                    p2 = t2 and t2 + '.'
+                    s = self._join_sqls[k] = ' AND '.join(
+                        f'{p2}{c2} = {t1}.{c1}' for c2, c1 in sjs)
+                return m2.as_(t2).where(SQL(s))
             r = Alias(m1, t1)
         return self._query(as_, r)
 
+    def preload(self, rs):
+        sjs = self.simple_joins or die(TypeError(f'unable to preload {self}'))
+        c2s = tuple(c2 for c2, c1 in sjs)
+        c1s = tuple(c1 for c2, c1 in sjs)
+        k = self.name
+        rs = [r for r in rs if k not in r.__dict__]
+        ks = [tuple(getattr(r, c) for c in c1s) for r in rs]
+        ks1 = {k: None for k in ks if None not in k}
+        xs = []
+        if ks1:
+            q = self.rel_model.query()
+            if len(c2s) == 1:
+                q = q.where(**{c2s[0]: IN(*(k[0] for k in ks1))})
+            else:
+                ps = '(' + ', '.join(('%s',) * len(c2s)) + ')'
+                q = q.where(SQL(
+                    f"({', '.join(c2s)}) IN ({', '.join((ps,) * len(ks1))})",
+                    *(v for k in ks1 for v in k)))
+            o = getattr(self, '_args', None)
+            o = o and o[2]
+            if o:
+                q = q.order_by(*((o,) if isinstance(o, str) else o))
+            xs = [*q]
+
+        k2xs = {}
+        for x in xs:
+            k2xs.setdefault(tuple(getattr(x, c) for c in c2s), []).append(x)
+        for r, k in zip(rs, ks):
+            self._preload_(r, r.__dict__, k2xs.get(k, ()))
+        return xs
+
     @cached_property
     def rel_model(self):
         return self.model.MODELS[self._args[0]]
@@ -165,6 +204,9 @@ class BelongsTo(Relation):
         self.reverse_b2 = False
         self.simple_joins = ((pk, k),)
 
+    def _preload_(self, obj, d, xs):
+        d[self.name] = xs[0] if xs else None
+
 
 class HasMany(Relation):
     def __init__(self, rel_name, where=None, *, order_by=None, cache=True):
@@ -176,6 +218,14 @@ class HasMany(Relation):
         rs = d[self.name] = self.query(obj).cache(self.cache)
         return rs
 
+    def _preload_(self, obj, d, xs):
+        q = d[self.name] = self.query(obj)
+        q._cache = [*xs]
+        rb2 = self.reverse_b2
+        if rb2:
+            for x in xs:
+                x.__dict__[rb2] = obj
+
     def _set_(self, obj, rs):
         if rs:
             m = self.rel_model
@@ -196,6 +246,12 @@ class HasOne(Relation):
         r = d[self.name] = self.query(obj).peek()
         return r
 
+    def _preload_(self, obj, d, xs):
+        r = d[self.name] = xs[0] if xs else None
+        rb2 = r is not None and self.reverse_b2
+        if rb2:
+            r.__dict__[rb2] = obj
+
     def _set_(self, obj, r):
         if r is not None:
             isinstance(r, self.rel_model) or die.type(r, self.rel_model)
@@ -0,0 +1,55 @@
+"""Bytes per record of plain and COMPACT models.
+
+    python -m tests.orm.bench_compact [n]
+"""
+from py3x.orm import database, model
+from py3x.orm.columns import INT, VARCHAR
+import sys
+import tracemalloc
+
+
+class Base(model.Model):
+    DB = database.Database()
+
+
+class Foo(Base):
+    DB_TABLE = 'foos'
+    id = INT(auto_increment=True, primary_key=True)
+    name = VARCHAR()
+    n = INT()
+
+
+class CFoo(Base):
+    COMPACT = True
+    DB_TABLE = 'foos'
+    id = INT(auto_increment=True, primary_key=True)
+    name = VARCHAR()
+    n = INT()
+
+
+def size(cls, n, fc=None, touch=False):
+    k2i = Base.DB.shared_index(('id', 'name', 'n'))
+    vss = [(i, 'x', 1) for i in range(n)]  # not counted, shared by both
+    fcks = [('foos', i) if fc is not None else None for i in range(n)]
+    tracemalloc.start()
+    rs = [cls.instantiate(k2i, vs, fck, fc) for vs, fck in zip(vss, fcks)]
+    if touch:
+        for r in rs:
+            r.__dict__
+    fc and fc.clear()  # the map itself costs the same for both
+    x = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return x / n
+
+
+def main(n=10000):
+    size(Foo, 100), size(CFoo, 100)  # warm up
+    for name, kw in (('plain', {}), ('identity map', dict(fc={})),
+                     ('__dict__ used', dict(touch=True))):
+        a = size(Foo, n, **kw)
+        b = size(CFoo, n, **kw)
+        print(f'{name:13} Foo {a:6.1f} B  CFoo {b:6.1f} B  ({b / a:.0%})')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,121 @@
+from py3x.orm import model
+from py3x.orm.aio import AsyncDatabase
+from py3x.orm.columns import INT, VARCHAR
+from py3x.orm.database import Database
+from time import monotonic, sleep
+import asyncio
+import pytest
+import threading
+
+
+class Csr:
+    description = (('id',), ('foo',))
+    rowcount = 1
+
+    def __init__(self, con):
+        self.con = con
+        self.rs = []
+
+    def __iter__(self):
+        return iter(self.rs)
+
+    def close(self):
+        self.con.closed_csrs += 1
+
+    def execute(self, sql, vs):
+        self.con.threads.add(threading.current_thread().name)
+        self.con.sqls.append(sql)
+        sleep(0.02)
+        n = 5 if 'LIMIT' not in sql else 1
+        self.rs = [(i, f'foo{i}') for i in range(1, n + 1)]
+
+    def fetchmany(self, size):
+        rs = self.rs[:size]
+        del self.rs[:size]
+        return rs
+
+    def fetchone(self):
+        return self.rs[0]
+
+
+class Con:
+    def __init__(self):
+        self.closed = False
+        self.closed_csrs = 0
+        self.sqls = []
+        self.threads = set()
+
+    def close(self):
+        self.closed = True
+
+    def cursor(self):
+        return Csr(self)
+
+
+class DB(Database):
+    def connect(self, **kw):
+        return Con()
+
+
+def models():
+    class Base(model.Model):
+        DB = DB()
+
+    class Foo(Base):
+        DB_TABLE = 'foos'
+
+        id = INT(primary_key=True)
+        foo = VARCHAR()
+
+    return Foo
+
+
+def test_AsyncDatabase():
+    Foo = models()
+    adb = AsyncDatabase(Foo.DB, workers=3)
+    with pytest.raises(TypeError):
+        AsyncDatabase(Foo.DB)
+
+    async def ticker(ts):
+        while True:
+            t = monotonic()
+            await asyncio.sleep(0.005)
+            ts.append(monotonic() - t)
+
+    async def main():
+        ts = []
+        tk = asyncio.ensure_future(ticker(ts))
+        rss = await asyncio.gather(*(Foo.query().all() for _ in range(6)))
+        assert [[r.id for r in rs] for rs in rss] == [[1, 2, 3, 4, 5]] * 6
+        assert await Foo.query().afirst() is not None
+        assert await Foo.query().acount() == 1
+
+        xs = [r.foo async for r in Foo.query().stream(2)]
+        assert xs == ['foo1', 'foo2', 'foo3', 'foo4', 'foo5']
+        async for r in Foo.query().stream(2):
+            break
+        assert r.id == 1
+
+        foo = Foo(id=9, foo='x')
+        assert await foo.asave() == 1
+        assert await adb.execute('SELECT 1', as_=1) == (1, 'foo1')
+        assert len(await adb.execute('SELECT 1')) == 5
+        assert await adb.txn(lambda: Foo.DB.txn_depth) == 1
+        tk.cancel()
+        return ts
+
+    ts = asyncio.run(main())
+    assert max(ts) < 0.1
+
+    cons = [*adb.cons]
+    assert len(cons) == 3
+    assert all(len(c.threads) == 1 for c in cons)
+    assert sum(c.closed_csrs for c in cons) >= 2
+    assert Foo.DB.local.con is None
+    adb.close()
+    assert all(c.closed for c in cons)
+    assert Foo.DB.aio is None
+
+    with pytest.raises(TypeError) as e:
+        Foo.query().all()
+    assert e.value.args[0].startswith('no AsyncDatabase for ')
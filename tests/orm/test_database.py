@@ -1,6 +1,10 @@
-from py3x.orm.database import Database
+from py3x.orm import PoolTimeout, SQL, model, mysql, postgres
+from py3x.orm.columns import INT
+from py3x.orm.database import Database, Pool
 from py3x.utils import die
+from tests.tlib import last_x, rs2csr, seq
 import pytest
+import threading
 
 
 def test_DB_close():
@@ -41,6 +45,19 @@ def test_DB_quote():
     db.quote = lambda v: v
     assert db.debug_quote('123456', limit=5) == '12...'
 
+    class Con:
+        def escape(self, b):
+            return b"'" + b + b"'"
+
+        def literal(self, v):
+            return str(v)
+
+    db = mysql.Database(pool=True)
+    db.connect = lambda **kw: Con()
+    assert [db.quote('a'), db.quote(1), db.quote(b'\x01')] == [
+        "'a'", '1', '0x01']
+    assert (db.local.con, db.pool.stats()['in_use']) == (None, 0)
+
 
 def test_Transaction():
     db = Database()
@@ -80,3 +97,366 @@ def test_Transaction():
         with db.txn_do():
             die('!')
     assert xs == ['BEGIN', 'ROLLBACK']
+
+    with db.txn_do():
+        db.bump_tables('foos')
+        assert db.table_versions == {'foos': 1}
+    assert db.table_versions == {'foos': 2}  # again on commit
+    with pytest.raises(RuntimeError):
+        with db.txn_do():
+            db.bump_tables('foos')
+            die('!')
+    assert db.table_versions == {'foos': 3}
+    assert not db.local.txn_tables
+
+    def other():  # its own connection, identity map and request memo
+        db._con = Con()
+        xs.append((db.find_cache, db.request_memo))
+        with db.identity_map(), db.request_cache():
+            db.begin()
+        xs.append(db.find_cache)
+
+    xs.clear()
+    with db.identity_map() as fc, db.request_cache() as rc:
+        fc['k'] = 1
+        t = threading.Thread(target=other)
+        t.start()
+        t.join()
+        assert (db.find_cache, db.request_memo) == (fc, rc)
+        assert db.find_cache.get('k') == 1
+    assert xs == [(None, None), 'BEGIN', None]
+
+
+def test_DB_count_estimate():
+    db = mysql.Database()
+    db.execute = rs2csr(('id', 'rows', 'filtered'), (1, 200, 50.0),
+                        (1, 3, 100.0))
+    assert db.count_estimate(SQL('SELECT 1 FROM foos WHERE x = %s', 1)) == 300
+    assert last_x() == (
+        'EXPLAIN SELECT 1 FROM foos WHERE x = %s', (1,), tuple)
+
+    db = postgres.Database()
+    db.execute = rs2csr(('reltuples',), (40.0,))
+    assert db.count_estimate(SQL('SELECT 1 FROM foos'), 'foos') == 40
+    db.execute = seq(
+        rs2csr(('reltuples',), (-1.0,)),
+        rs2csr(('QUERY PLAN',), ([{'Plan': {'Plan Rows': 12}}],)))
+    assert db.count_estimate(SQL('SELECT 1 FROM foos'), 'foos') == 12
+    assert db.execute.args[1] == (
+        'EXPLAIN (FORMAT JSON) SELECT 1 FROM foos', ())
+
+
+def test_DB_hooks():
+    class Base(model.Model):
+        DB = Database()
+
+    class Foo(Base):
+        DB_TABLE = 'foos'
+        id = INT(primary_key=True)
+
+    class Csr:
+        description = (('id',),)
+        rowcount = 1
+
+        def __iter__(self):
+            return iter(((1,),))
+
+        def execute(self, sql, vs):
+            sql == 'ERR' and die('!')
+
+    class Con:
+        def cursor(self):
+            return Csr()
+
+    db = Foo.DB
+    db._con = Con()
+    xs = []
+    h1 = db.add_hook(before=lambda x: xs.append(('before', x.sql)),
+                     after=lambda x: xs.append(('after', x)))
+    h2 = db.add_hook(error=lambda x, e: xs.append(('error', x, e)))
+
+    q = Foo.where(id=1)
+    assert [*q][0].id == 1
+    assert xs[0] == ('before', 'SELECT * FROM foos t1 WHERE id = %s')
+    x = xs[1][1]
+    assert (x.sql, x.vs, x.caller, x.rowcount) == (xs[0][1], (1,), q, 1)
+    assert x.elapsed >= 0
+
+    xs.clear()
+    with pytest.raises(RuntimeError):
+        db.execute('ERR')
+    assert [x[0] for x in xs] == ['before', 'error']
+    assert xs[1][1].caller is None
+    assert xs[1][2].args == ('!',)
+
+    db.remove_hook(h1)
+    db.remove_hook(h2)
+    assert db.hooks == ()
+
+
+def test_DB_pool():
+    class Csr:
+        description = (('x',),)
+        rowcount = 1
+
+        def __init__(self, con):
+            self.con = con
+
+        def __iter__(self):
+            return iter(((self.con.id,),))
+
+        def close(self):
+            pass
+
+        def execute(self, sql, *vs):
+            self.con.broken and die('gone away')
+            self.con.sqls.append(sql if vs else 'PING')
+            if sql.startswith('INSERT'):
+                self.description = None
+
+        def fetchmany(self, size):
+            rs, self.rs = getattr(self, 'rs', [(1,), (2,)]), []
+            return rs
+
+        def fetchone(self):
+            return (self.con.id,)
+
+    class Con:
+        def __init__(self, id):
+            self.id = id
+            self.broken = self.closed = False
+            self.sqls = []
+
+        def close(self):
+            self.closed = True
+
+        def cursor(self):
+            return Csr(self)
+
+        def rollback(self):
+            self.sqls.append('ROLLBACK')
+
+    cons = []
+
+    def connect(**kw):
+        cons.append(Con(len(cons) + 1))
+        return cons[-1]
+
+    db = Database(pool=dict(min_size=1, max_size=2, timeout=0.01))
+    db.connect = connect
+    p = db.pool
+    assert db.execute('SELECT 1', (), 1) == (1,)
+    assert db.local.con is None
+    assert p.stats()['idle'] == 1
+
+    with db.txn_do():
+        assert db.execute('SELECT 1', (), 1) == (1,)
+        assert p.stats()['in_use'] == 1
+        with db.txn_do():
+            db.execute('SELECT 2')
+        db.execute('SELECT 3')
+    assert cons[0].sqls == [
+        'SELECT 1', 'BEGIN', 'SELECT 1', 'SAVEPOINT p1',
+        'SELECT 2', 'RELEASE SAVEPOINT p1', 'SELECT 3', 'COMMIT']
+    assert p.stats()['in_use'] == 0
+
+    del cons[0].sqls[:]
+    db.execute('INSERT 1', ())
+    assert p.stats()['in_use'] == 1  # not committed yet: kept
+    db.execute('SELECT 1', ())
+    db.commit()
+    assert p.stats()['in_use'] == 0
+    db.execute('INSERT 2', ())
+    db.release()
+    assert cons[0].sqls == [
+        'INSERT 1', 'SELECT 1', 'COMMIT', 'INSERT 2', 'ROLLBACK']
+    db.autocommit = lambda con: True
+    db.execute('INSERT 3', ())
+    assert p.stats()['in_use'] == 0
+    del db.autocommit
+
+    c1, c2 = p.get(), p.get()
+    with pytest.raises(PoolTimeout):
+        db.execute('SELECT 1')
+    x = p.stats()
+    assert (x['in_use'], x['utilization'], x['waits'], x['timeouts']) == (
+        2, 1.0, 1, 1)
+    assert x['wait_max'] >= 0.01
+    p.put(c1)
+    p.put(c2)
+
+    cons[1].broken = True
+    p.ping_after = 0
+    assert db.execute('SELECT 1', (), 1) == (1,)
+    assert p.size == 1
+
+    csr = db.stream('SELECT x', (), 2)
+    assert db.execute('SELECT 1', (), 1) == (1,)  # pinned by the stream
+    assert p.stats()['in_use'] == 1
+    assert [*csr] == [(1,), (2,)]
+    assert p.stats()['in_use'] == 0
+
+    p.idle = 0
+    p.min_size = 0
+    with db.checkout():
+        db.execute('SELECT 1')
+        db.execute('SELECT 1')
+        assert p.stats()['in_use'] == 1
+    assert [c.closed for c in cons] == [True, True, False]  # recycled
+    assert db.execute('SELECT 1', (), 1) == (4,)
+    assert cons[2].closed
+    assert p.fill() is p
+
+    db.close()
+    assert p.stats()['size'] == 0
+    assert cons[3].closed
+    with pytest.raises(RuntimeError) as e:
+        db.execute('SELECT 1')
+    assert e.value.args == ('connection pool is closed',)
+
+    p = Pool(connect, reset=lambda con: die('!'))
+    p.put(p.get())
+    assert (p.size, cons[-1].closed) == (0, True)
+
+
+def test_DB_replicas():
+    class Csr:
+        description = (('host',),)
+        rowcount = 1
+
+        def __init__(self, con):
+            self.con = con
+
+        def __iter__(self):
+            return iter(((self.con.host,),))
+
+        def close(self):
+            pass
+
+        def execute(self, sql, vs):
+            self.con.sqls.append(sql)
+
+        def fetchmany(self, size):
+            rs, self.rs = getattr(self, 'rs', [(self.con.host,)]), []
+            return rs
+
+        def fetchone(self):
+            return (self.con.host,)
+
+    class Con:
+        def __init__(self, host):
+            self.host = host
+            self.sqls = []
+
+        def close(self):
+            pass
+
+        def cursor(self):
+            return Csr(self)
+
+    class RDB(Database):
+        def connect(self, host='p'):
+            return Con(host)
+
+    class Base(model.Model):
+        DB = RDB(replicas=[dict(host='r1'), dict(host='r2')])
+
+    class Foo(Base):
+        DB_TABLE = 'foos'
+        id = INT(primary_key=True)
+
+    db = Foo.DB
+    q = Foo.query()
+    assert [q.count(), q.count(), q.count()] == ['r1', 'r2', 'r1']
+    assert [q.exists(), [*db.pluck('SELECT 1')]] == [True, ['r1']]
+    assert [*Foo.query().select(SQL('id AS host')).pluck('host')] == ['r2']
+    assert db.execute('SELECT 1', (), 1) == ('p',)
+    with db.txn_do():
+        assert q.count() == 'p'
+    assert q.for_update().peek().get('host') == 'p'
+    assert [r.get('host') for r in q.for_update().stream()] == ['p']
+
+    db.replica_policy = 'least_loaded'
+    db.replicas[0].inflight = 1
+    assert [q.count(), q.count()] == ['r2', 'r2']
+
+    h = db.add_hook(after=lambda x: xs.append(x.db.con_kw))
+    xs = []
+    q.count()
+    assert xs == [dict(host='r2')]
+    db.remove_hook(h)
+    assert db.replicas[1].hooks == ()
+
+    db.read_your_writes = 10
+    Foo.where(id=1).update(id=2).execute()
+    assert q.count() == 'p'
+    db.local.rw_until = 0
+    assert q.count() == 'r2'
+
+    with pytest.raises(TypeError) as e:
+        RDB(replica_policy='x')
+    assert e.value.args == ("unknown replica policy: 'x'",)
+
+
+def test_DB_pipeline():
+    class Base(model.Model):
+        DB = Database()
+
+    class Foo(Base):
+        DB_TABLE = 'foos'
+        id = INT(primary_key=True)
+
+    db = Foo.DB
+    db.execute = x = seq(
+        rs2csr(('a', 'b', 'c'), (3, 1, 0)),
+        rs2csr(('id',), (1,), (2,)),
+        rs2csr(('n',), (7,)))
+    with db.pipeline() as p:
+        p.count(Foo.query()).exists(Foo.where(id=1)).add(Foo.where(id=2))
+        p.add(SQL('SELECT %s', 7)).exists(Foo.where(id=3))
+    n, e1, foos, rs, e2 = p.results
+    assert (n, e1, [r.id for r in foos], rs, e2) == (
+        3, True, [1, 2], [(7,)], False)
+    assert x.args == [
+        ('SELECT (SELECT COUNT(1) FROM foos t1), '
+         'EXISTS (SELECT 1 FROM foos t1 WHERE id = %s), '
+         'EXISTS (SELECT 1 FROM foos t1 WHERE id = %s)', (1, 3)),
+        ('SELECT * FROM foos t1 WHERE id = %s', (2,)),
+        ('SELECT %s', (7,))]
+    assert db.pipeline().execute() == []
+
+    with pytest.raises(TypeError) as e:
+        db.pipeline().add(Foo.query().delete())
+    assert e.value.args == ('pipeline() takes only SELECT',)
+
+    class Csr:
+        def __init__(self):
+            self.sets = [((('n', 'e'),), [(3, 1)]), ((('id',),), [(1,)])]
+            self.nextset()
+
+        def __iter__(self):
+            return iter(self.rs)
+
+        def execute(self, sql, vs):
+            xs.append((sql, vs))
+
+        def nextset(self):
+            if self.sets:
+                self.description, self.rs = self.sets.pop(0)
+                return True
+
+    class Con:
+        def cursor(self):
+            return Csr()
+
+        def set_server_option(self, x):
+            xs.append(x)
+
+    xs = []
+    db = mysql.Database()
+    db._con = Con()
+    assert db.pipeline().count(Foo.query()).exists(Foo.query()).add(
+        SQL('SELECT id FROM foos')).execute() == [3, 1, [(1,)]]
+    assert xs == [0, (
+        'SELECT (SELECT COUNT(1) FROM foos t1), '
+        'EXISTS (SELECT 1 FROM foos t1);\nSELECT id FROM foos', []), 1]
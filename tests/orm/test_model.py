@@ -1,8 +1,11 @@
-from py3x.orm import ColumnNotLoaded, IN, RecordNotFound, SQL, database, model
+from py3x.orm import ColumnNotLoaded, IN, RecordNotFound, SQL, database, \
+    model, mysql, postgres
 from py3x.orm.columns import BELONGS_TO, BOOL, DATE, DATETIME, INT, VARCHAR
 from py3x.orm.model import NOW
+from py3x.orm.relations import HasMany
 from py3x.utils import Date, DateTime, Util, XEnum, qw
-from tests.tlib import instantiate, last_x, r2csr, rs2csr
+from tests.tlib import instantiate, last_x, r2csr, rs2csr, seq
+from types import SimpleNamespace
 import py3x.errors as errors
 import pytest
 
@@ -165,6 +168,94 @@ def test_find():
     assert fc == {}
 
 
+def test_find_many():
+    Base, User, Foo, Bar, Baz = models()
+    DB = Base.DB
+
+    DB.execute = rs2csr(('id',), (3,), (1,))
+    foos = Foo.find_many((1, '3', 1, None), skip=True)
+    assert [f.id for f in foos] == [1, 3, 1]
+    assert foos[0] is foos[2]
+    assert last_x() == (
+        'SELECT * FROM foos t1 WHERE id IN (%s, %s)', (1, 3), tuple)
+
+    with pytest.raises(RecordNotFound) as e:
+        Foo.find_many(('x', 1, 2))
+    assert e.value.args == ('foos', 'x', 2)
+
+    with pytest.raises(TypeError):
+        Foo.find_many((SQL('1'),))
+
+    foo2 = instantiate(Foo, id=2)
+    fc = DB.find_cache = {('foos', 2): foo2}
+    DB.execute = seq(rs2csr(('id',), (1,)), rs2csr(('id',), (3,)))
+    assert Foo.find_many(range(1, 4), per=1) == [fc[('foos', 1)], foo2,
+                                                 fc[('foos', 3)]]
+    assert DB.execute.args == [
+        ('SELECT * FROM foos t1 WHERE id IN (%s)', (1,)),
+        ('SELECT * FROM foos t1 WHERE id IN (%s)', (3,))]
+    DB.find_cache = None
+
+    class Baz(Base):
+        DB_TABLE = 'bazs'
+        foo_id = BELONGS_TO(Foo, primary_key=True)
+        no = INT(primary_key=True)
+
+    DB.execute = rs2csr(qw('foo_id no'), (1, 2))
+    bazs = Baz.find_many([(1, 2), (3, 4)], skip=True)
+    assert [(b.foo_id, b.no) for b in bazs] == [(1, 2)]
+    assert last_x() == (
+        'SELECT * FROM bazs t1 WHERE (foo_id, no) IN ((%s, %s), (%s, %s))',
+        (1, 2, 3, 4), tuple)
+
+    with pytest.raises(TypeError):
+        Baz.find_many([1])
+
+
+def test_identity_map():
+    Base, User, Foo, Bar, Baz = models()
+    DB = Base.DB
+    DB.execute = seq(*(r2csr(id=i, name=f'n{i}') for i in (1, 2, 3, 4, 4, 1)))
+    with DB.identity_map(3) as fc:
+        assert DB.find_cache is fc
+        bar1 = Bar.find(1)
+        assert Bar.find('1') is bar1
+        assert Bar.find(2).id + Bar.find(3).id == 5
+        assert [*fc] == [('bars', 1), ('bars', 2), ('bars', 3)]
+
+        bar4 = Bar.find_by(name='n4')
+        assert [*fc] == [('bars', 3), ('bars', 4), ('bars', 'name', 'n4')]
+        assert '.fck' not in bar1.__dict__
+        assert Bar.find_by(name='n4') is bar4
+        assert fc.stats() == dict(hits=2, misses=4, evictions=2, size=3,
+                                  maxsize=3)
+
+        bar4.__dict__['.dbvs'] = (4, 'x')  # renamed
+        assert Bar.find_by(name='n4') is not bar4
+        assert Bar.find(1) is not bar1
+        assert len(DB.execute.args) == 6
+
+        DB._con_x = lambda x: None
+        DB.begin()
+        assert not fc
+        DB.txn_depth = 0
+    assert DB.find_cache is None
+
+    DB.execute = r2csr(id=5, name='n5')
+    with DB.identity_map(weak=True, scope='request') as fc:
+        bar = Bar.find(5)
+        assert fc.get(('bars', 5)) is bar
+        DB.begin()
+        assert fc.get(('bars', 5)) is bar
+        del bar
+        assert (len(fc), fc.stats()['evictions']) == (0, 1)
+        DB.txn_depth = 0
+
+    with pytest.raises(TypeError) as e:
+        DB.identity_map(scope='x')
+    assert e.value.args == ("unknown identity map scope: 'x'",)
+
+
 def test___init__():
     Base, User, Foo, Bar, Baz = models()
     bar = Bar(name='!', x=1)
@@ -211,6 +302,128 @@ def test_attr_in_db():
     assert bar.chks == [bar.CHKS.A, bar.CHKS.C]
 
 
+def test_bulk_update():
+    Base, User, Foo, Bar, Baz = models()
+    DB = Base.DB
+    us = [instantiate(User, id=i, name=f'u{i}') for i in (1, 2, 3)]
+    us[0].name = 'x'
+    us[1].name = 'y'
+    bars = [instantiate(Bar, id=i, name='b', lock_version=1) for i in (1, 2)]
+    for bar, name in zip(bars, 'cd'):
+        bar.name = name
+        bar.lock_version = 1
+
+    DB.execute = seq(lambda *a: 2)
+    assert User.bulk_update(us) == 2
+    assert DB.execute.args == [(
+        'UPDATE users SET name = CASE id WHEN %s THEN %s WHEN %s THEN %s END '
+        'WHERE id IN (%s, %s)', [1, 'x', 2, 'y', 1, 2])]
+    assert [u.attr_in_db('name') for u in us] == ['x', 'y', 'u3']
+    assert not any(u.is_changed() for u in us)
+
+    class Con:
+        def __getattr__(self, k):
+            return lambda: xs.append(k.upper())
+
+    # bar 2 was bumped once by another writer, to the very version ours
+    # would set: still a conflict
+    xs = []
+    DB._con = Con()
+    DB.execute = seq(lambda *a: 1, lambda *a: 1, lambda *a: 0)
+    assert Bar.bulk_update(bars, timestamp=False) == 1
+    u = 'UPDATE bars SET name = %s, lock_version = %s ' \
+        'WHERE id = %s AND lock_version = %s'
+    assert DB.execute.args == [(
+        'UPDATE bars SET name = CASE id WHEN %s THEN %s WHEN %s THEN %s END, '
+        'lock_version = CASE id WHEN %s THEN %s WHEN %s THEN %s END '
+        'WHERE (id, lock_version) IN ((%s, %s), (%s, %s))',
+        [1, 'c', 2, 'd', 1, 2, 2, 2, 1, 1, 2, 1],
+    ), (u, ('c', 2, 1, 1)), (u, ('d', 2, 2, 1))]
+    assert xs == ['BEGIN', 'ROLLBACK', 'BEGIN', 'COMMIT']
+    assert (bars[0].attr_in_db('lock_version'), bars[0].errors) == (2, {})
+    assert bars[1].errors == {None: [errors.CONFLICT]}
+    assert bars[1].attr_in_db('name') == 'b'
+
+    bar = instantiate(Bar, id=3, name='b', chks=1)
+    bar.name = SQL("CONCAT(name, '!')")
+    bar.chks = [bar.CHKS.A, bar.CHKS.B]
+    DB.execute = seq(lambda *a: 1)
+    assert Bar.bulk_update([bar], ('name',), timestamp=False) == 1
+    assert DB.execute.args == [(
+        "UPDATE bars t1 SET name = CONCAT(name, '!') WHERE id = %s", (3,))]
+    assert bar.is_changed('chks') and not bar.is_changed('name')
+
+    class PgDB(postgres.Database):
+        pass
+
+    DB = User.DB = PgDB()
+    DB.execute = x = seq(rs2csr(('k0',), (1,)))
+    us[0].name = 'z'
+    assert User.bulk_update(us, ('name',), per=10) == 1
+    assert x.args == [(
+        'UPDATE users SET name = v.k1 FROM (SELECT id AS k0, name AS k1 '
+        'FROM users WHERE FALSE UNION ALL VALUES (%s, %s)) v '
+        'WHERE users.id = v.k0 RETURNING v.k0', [1, 'z'])]
+
+
+def test_compact():
+    import tracemalloc
+    Base, User, Foo, Bar, Baz = models()
+
+    class CBar(Base):
+        COMPACT = True
+        DB_TABLE = 'bars'
+        id = INT(auto_increment=True, primary_key=True)
+        foo_id = BELONGS_TO(Foo)
+        name = VARCHAR()
+        chks = INT(choices=XEnum(A=1, B=2, C=4), multiple=True)
+        rad = BOOL()
+
+    bar = instantiate(CBar, id=1, foo_id=2, name='x', chks=3)
+    assert isinstance(bar, CBar) and type(bar).__name__ == 'CBar'
+    assert (bar.id, bar.foo_id, bar.name) == (1, 2, 'x')
+    assert bar._k2i is not None  # no __dict__ yet
+    assert bar.chks == [bar.CHKS.A, bar.CHKS.B]
+    with pytest.raises(ColumnNotLoaded):
+        bar.rad
+    assert bar.is_changed() is False
+
+    bar.foo_id = 3
+    bar.name = 'y'
+    assert (bar.foo_id, bar.name, bar.attr_in_db('name')) == (3, 'y', 'x')
+    assert bar.is_changed(txn={}) == {'foo_id': 3, 'name': 'y'}
+    assert not bar.is_new_record()
+
+    bar = instantiate(CBar, id=1, foo_id=2)
+    bar.foo = foo = Foo(id=3)
+    assert bar.foo is foo and bar.foo_id == 3
+
+    DB = Base.DB
+    with DB.identity_map(maxsize=1) as fc:
+        DB.execute = r2csr(id=5, name='n')
+        bar = CBar.find(5)
+        assert (bar._k2i is not None, bar._fck) == (True, ('bars', 5))
+        assert CBar.find(5) is bar and bar._k2i is not None
+        assert bar.__dict__['.fck'] == ('bars', 5) and bar._fck is None
+        DB.execute = r2csr(id=6, name='m')
+        bar6 = CBar.find(6)
+        assert '.fck' not in bar.__dict__ and [*fc] == [('bars', 6)]
+        assert bar6._fck == ('bars', 6) and bar6._k2i is not None
+
+    k2i = Base.DB.shared_index(('id', 'name', 'chks'))
+    vss = [(i, 'x', 1) for i in range(1000)]
+
+    def size(cls):
+        tracemalloc.start()
+        rs = [cls.instantiate(k2i, vs, None, None) for vs in vss]
+        x = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return x / len(rs)
+
+    size(Bar), size(CBar)  # warm up
+    assert size(CBar) < size(Bar) * 0.8
+
+
 def test_delete():
     Base, User, Foo, Bar, Baz = models()
     bar = instantiate(Bar, id=100)
@@ -345,6 +558,90 @@ def test_restore_attrs():
     assert bar.foo_id == 1
 
 
+def test_insert_graph():
+    Base, User, Foo, Bar, Baz = models()
+
+    class Order(Base):
+        DB_TABLE = 'orders'
+        id = INT(auto_increment=True, primary_key=True)
+        user_id = BELONGS_TO(User)
+        items = HasMany('Item')
+
+    class Item(Base):
+        DB_TABLE = 'items'
+        id = INT(auto_increment=True, primary_key=True)
+        order_id = BELONGS_TO(Order)
+        sku = VARCHAR()
+
+    class PgDB(postgres.Database):
+        pass
+
+    u = User(name='u')
+    os = [Order(user=u), Order(user=u)]
+    os[0].items = [Item(sku='a'), Item(sku='b')]
+    os[1].items = [Item(sku='c')]
+    DB = Base.DB = PgDB()
+    DB.execute = x = seq(
+        rs2csr(('id',), (1,)), rs2csr(('id',), (10,), (11,)),
+        rs2csr(('id',), (20,), (21,), (22,)))
+    assert Order.insert_graph(os) == 6
+    assert x.args == [
+        ('INSERT INTO users (name) VALUES (%s) RETURNING id', ['u']),
+        ('INSERT INTO orders (user_id) VALUES (%s), (%s) RETURNING id',
+         [1, 1]),
+        ('INSERT INTO items (order_id, sku) VALUES (%s, %s), (%s, %s), '
+         '(%s, %s) RETURNING id', [10, 'a', 10, 'b', 11, 'c'])]
+    its = [*os[0].items, *os[1].items]
+    assert [i.id for i in its] == [20, 21, 22]
+    assert [i.order_id for i in its] == [10, 10, 11]
+    assert not any(r.is_new_record() for r in (u, *os, *its))
+    assert Order.insert_graph(os) == 0
+
+
+def test_insert_many():
+    Base, User, Foo, Bar, Baz = models()
+    DB = Base.DB
+    us = [User(name='a'), User(name='b'), User(id=9, name='c')]
+    with pytest.raises(NotImplementedError):
+        User.insert_many(us[:1])
+
+    ids = []
+    DB.execute = x = seq(lambda *a: 1)
+    DB.execute_insert_many = lambda *a: ids.append(a) or range(5, 6)
+    assert User.insert_many(us[1:]) == 2
+    assert ids == [('INSERT INTO users (name) VALUES (%s)', ['b'], 'id', 1)]
+    assert x.args == [
+        ('INSERT INTO users (id, name) VALUES (%s, %s)', [9, 'c'])]
+    assert [u.id for u in us[1:]] == [5, 9]
+
+    class MyDB(mysql.Database):
+        pass
+
+    us = [User(name='a'), User(name='b'), User(id=9, name='c')]
+    DB = User.DB = MyDB()
+    DB.server_var = lambda k: 2
+    DB.execute = x = seq(
+        lambda *a: SimpleNamespace(lastrowid=11), lambda *a: 1)
+    assert User.insert_many(us) == 3
+    assert x.args == [
+        ('INSERT INTO users (name) VALUES (%s), (%s)', ['a', 'b']),
+        ('INSERT INTO users (id, name) VALUES (%s, %s)', [9, 'c'])]
+    assert [u.id for u in us] == [11, 13, 9]
+    assert not any(u.is_new_record() or u.is_changed() for u in us)
+
+    class PgDB(postgres.Database):
+        pass
+
+    us = [User(name='a'), User(name='b')]
+    DB = User.DB = PgDB()
+    DB.execute = x = seq(rs2csr(('id',), (3,)), rs2csr(('id',), (4,)))
+    assert User.insert_many(us, per=1) == 2
+    assert x.args == [
+        ('INSERT INTO users (name) VALUES (%s) RETURNING id', ['a']),
+        ('INSERT INTO users (name) VALUES (%s) RETURNING id', ['b'])]
+    assert [u.id for u in us] == [3, 4]
+
+
 def test_save():
     Base, User, Foo, Bar, Baz = models()
 
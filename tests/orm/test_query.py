@@ -1,8 +1,10 @@
-from py3x.orm import ColumnNotLoaded, SQL, IN, LIKE, NE, database, model
-from py3x.orm.columns import BELONGS_TO, BOOL, INT, VARCHAR
+from array import array
+from py3x.orm import ColumnNotLoaded, SQL, IN, LIKE, NE, database, model, \
+    postgres
+from py3x.orm.columns import BELONGS_TO, BOOL, INT, TEXT, VARCHAR
 from py3x.orm.relations import HasMany, HasOne
-from py3x.utils import qw
-from tests.tlib import last_x, rs2csr
+from py3x.utils import die, qw
+from tests.tlib import last_x, r2csr, rs2csr, seq
 import pytest
 import re
 
@@ -287,6 +289,54 @@ def test_Query_delete():
         'WHERE t1.id = %s', (1,), int)]
 
 
+def test_Query_execute_in_batches():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    class Con:
+        def begin(self):
+            xs.append('BEGIN')
+
+        def commit(self):
+            xs.append('COMMIT')
+
+    xs = []
+    DB._con = Con()
+    DB.execute = seq(r2csr(id=2), lambda *a: 2, r2csr(id=5), lambda *a: 2,
+                     lambda *a: None, lambda *a: 1)
+    q = Bar.where(bar='x').update(bar='y')
+    assert q.execute_in_batches(2, progress=lambda *a: xs.append(a)) == 5
+    s = 'SELECT id FROM bars t1 WHERE bar = %s'
+    o = 'ORDER BY id LIMIT %s OFFSET %s'
+    u = 'UPDATE bars t1 SET bar = %s WHERE bar = %s'
+    assert DB.execute.args == [
+        (f'{s} {o}', ('x', 1, 1)),
+        (f'{u} AND id <= %s', ('y', 'x', 2)),
+        (f'{s} AND id > %s {o}', ('x', 2, 1, 1)),
+        (f'{u} AND id > %s AND id <= %s', ('y', 'x', 2, 5)),
+        (f'{s} AND id > %s {o}', ('x', 5, 1, 1)),
+        (f'{u} AND id > %s', ('y', 'x', 5))]
+    assert xs == [
+        'BEGIN', 'COMMIT', (2, 2), 'BEGIN', 'COMMIT', (5, 2),
+        'BEGIN', 'COMMIT', (None, 1)]
+
+    DB.execute = seq(lambda *a: None, lambda *a: 0)
+    assert Baz.where(bar_id=1).delete().execute_in_batches(after=7) == 0
+    assert DB.execute.args == [
+        ('SELECT id FROM bazs t1 WHERE bar_id = %s AND id > %s '
+         'ORDER BY id LIMIT %s OFFSET %s', (1, 7, 1, 999)),
+        ('DELETE t1 FROM bazs t1 WHERE bar_id = %s AND id > %s', (1, 7))]
+
+    with pytest.raises(TypeError) as e:
+        Bar.where(bar='x').execute_in_batches()
+    assert e.value.args == ('no update() or delete()',)
+    with pytest.raises(TypeError):
+        Bar.query().limit(1).delete().execute_in_batches()
+    DB.txn_depth = 1
+    with pytest.raises(RuntimeError):
+        Bar.query().delete().execute_in_batches()
+
+
 def test_Query_update():
     Foo, Bar, Bar2, Baz = models()
 
@@ -618,3 +668,419 @@ def test_Query_with_select():
         "FROM bazs t1 "
         "LEFT JOIN bars t2 ON t2.id = t1.bar_id "
         "JOIN foos t3 ON t3.id = t2.foo_id")
+
+
+def test_Query_statement_cache():
+    Foo, Bar, Bar2, Baz = models()
+    sc = Foo.query().STATEMENT_CACHE
+    sc.clear()
+
+    assert Bar.where(id=1).sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id = %s', 1)
+    assert sc.stats() == dict(hits=0, misses=1, size=1, maxsize=1024)
+    assert Bar.where(id=2).sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id = %s', 2)
+    assert Bar.where(id=IN(3, 4)).count_sql() == SQL(
+        'SELECT COUNT(1) FROM bars t1 WHERE id IN (%s, %s)', 3, 4)
+    assert Bar.where(id=IN(5, 6)).exists_sql() == SQL(
+        'EXISTS (SELECT 1 FROM bars t1 WHERE id IN (%s, %s))', 5, 6)
+    assert (sc.hits, sc.misses) == (2, 2)
+
+    q = Foo.query().join('bars').where('t2', bar='x').order_by('t2.id')
+    sc.clear()
+    for v in ('x', 'y'):
+        assert q.where('t2', bar=v).limit(3).offset(0).sql() == SQL(
+            'SELECT t1.* FROM foos t1 JOIN bars t2 ON t2.foo_id = t1.id '
+            'WHERE t2.bar = %s AND t2.bar = %s ORDER BY t2.id LIMIT %s',
+            'x', v, 3)
+    assert (sc.hits, sc.misses) == (1, 1)
+
+    assert Foo.bars.query('t1').sql() == SQL(
+        'SELECT * FROM bars WHERE foo_id = t1.id')
+    assert Foo.bars._join_sqls == {
+        ('t1', 't2'): 't2.foo_id = t1.id', ('t1', ''): 'foo_id = t1.id'}
+
+    q = Bar.where(id=1).limit(0)
+    assert q.sql() == q.sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id = %s LIMIT %s', 1, 0)
+    assert sc.hits == 2
+
+    sc.maxsize = 0
+    assert Bar.where(id=1).sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id = %s', 1)
+    sc.maxsize = 1024
+
+
+def test_Query_stream():
+    Foo, Bar, Bar2, Baz = models()
+    xs = []
+
+    class Csr:
+        description = None
+
+        def close(self):
+            xs.append('close')
+
+        def execute(self, sql, vs):
+            xs.append((sql, vs))
+            self.rs = [*rs]
+
+        def fetchmany(self, n):
+            xs.append(n)
+            self.description = tuple((h,) for h in hs)
+            r = self.rs[:n]
+            del self.rs[:n]
+            return r
+
+    Foo.DB.stream_cursor = lambda size: Csr()
+    hs = qw('id foo_id bar')
+    rs = [(1, 1, 'A'), (2, 1, 'B'), (3, 2, 'C')]
+    assert [(r.id, r.bar) for r in Bar.where(bar=LIKE('%')).stream(2)] == [
+        (1, 'A'), (2, 'B'), (3, 'C')]
+    assert xs == [
+        ('SELECT * FROM bars t1 WHERE bar LIKE %s', ('%',)),
+        2, 2, 2, 'close']
+
+    xs.clear()
+    hs = qw('id id foo')
+    rs = [(1, 1, 'A'), (2, 1, 'A')]
+    q = Bar.query().join('foo').select(t1=('id',), t2='*')
+    bars = [*q.stream()]
+    assert [b.id for b in bars] == [1, 2]
+    assert bars[0].foo is bars[1].foo
+    assert bars[0].foo.foo == 'A'
+    assert xs[1:] == [1000, 1000, 'close']
+
+
+def test_Query_page_after():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    with pytest.raises(TypeError) as e:
+        Bar.query().next_cursor
+    assert e.value.args == ('page_after() not called',)
+
+    q = Bar.query().order_by('bar DESC').page_after(None, 2)
+    assert q.sql() == SQL(
+        'SELECT * FROM bars t1 ORDER BY bar DESC, id ASC LIMIT %s', 3)
+    DB.execute = rs2csr(qw('id bar'), (3, 'c'), (1, 'b'), (2, 'b'))
+    assert [r.id for r in q] == [3, 1]
+    assert q.prev_cursor is None
+    nc = q.next_cursor
+
+    q = Bar.query().order_by('bar DESC').page_after(nc, 2)
+    assert q.sql() == SQL(
+        'SELECT * FROM bars t1 WHERE ((bar < %s) OR (bar = %s AND id > %s)) '
+        'ORDER BY bar DESC, id ASC LIMIT %s', 'b', 'b', 1, 3)
+    DB.execute = rs2csr(qw('id bar'), (2, 'b'), (4, 'a'))
+    assert [r.id for r in q] == [2, 4]
+    assert q.next_cursor is None
+    pc = q.prev_cursor
+
+    q = Bar.query().order_by('bar DESC').page_after(pc, 2)
+    assert q.sql() == SQL(
+        'SELECT * FROM bars t1 WHERE ((bar > %s) OR (bar = %s AND id < %s)) '
+        'ORDER BY bar ASC, id DESC LIMIT %s', 'b', 'b', 2, 3)
+    DB.execute = rs2csr(qw('id bar'), (1, 'b'), (3, 'c'))
+    assert [r.id for r in q] == [3, 1]
+    assert q.prev_cursor is None
+    assert q.next_cursor
+
+    q = Bar.query().join('foo').page_after(q.next_cursor, '10')
+    assert q.sql() == SQL(  # cursor of another order => first page
+        'SELECT t1.* FROM bars t1 JOIN foos t2 ON t2.id = t1.foo_id '
+        'ORDER BY t1.id ASC LIMIT %s', 11)
+    DB.execute = rs2csr(qw('id'), *((i,) for i in range(1, 12)))
+    assert len(q) == 10
+    q = Bar.query().join('foo').page_after(q.next_cursor, '10')
+    assert q.sql() == SQL(
+        'SELECT t1.* FROM bars t1 JOIN foos t2 ON t2.id = t1.foo_id '
+        'WHERE t1.id > %s ORDER BY t1.id ASC LIMIT %s', 10, 11)
+
+    q = Bar.query().page_after('!', 0)
+    assert q.sql() == SQL(
+        'SELECT * FROM bars t1 ORDER BY id ASC LIMIT %s', 26)
+
+    with pytest.raises(TypeError) as e:
+        Bar.query().order_by(SQL('RAND()')).page_after()
+    assert e.value.args == (
+        "keyset pagination does not support SQL('RAND()')",)
+
+    Bar.COLUMNS['bar'].null = True
+    with pytest.raises(TypeError) as e:
+        Bar.query().order_by('bar').page_after()
+    assert e.value.args == ("keyset column must be NOT NULL: 'bar'",)
+
+
+def test_Query_preload():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    DB.execute = x = seq(
+        rs2csr(qw('id foo_id bar'), (1, 1, 'A'), (2, 1, 'B'), (3, 2, 'C')),
+        rs2csr(qw('id foo'), (1, 'a'), (2, 'b')),
+        rs2csr(qw('id bar_id baz'), (1, 1, ''), (2, 1, ''), (3, 3, '')),
+        rs2csr(qw('bar_id foo_id'), (3, 2)),
+        rs2csr(qw('id bar_id baz'), (3, 3, '')))
+    bars = Bar.where(bar=NE('')).preload('foo', 'bazs.bar', 'bar2')\
+        .preload('last_baz')
+    with pytest.raises(TypeError) as e:
+        len(bars)
+    assert e.value.args == ('unable to preload Bar.last_baz',)
+    assert x.args == [
+        ('SELECT * FROM bars t1 WHERE bar != %s', ('',)),
+        ('SELECT * FROM foos t1 WHERE id IN (%s, %s)', (1, 2)),
+        ('SELECT * FROM bazs t1 WHERE bar_id IN (%s, %s, %s) ORDER BY id',
+         (1, 2, 3)),
+        ('SELECT * FROM bar2s t1 WHERE bar_id IN (%s, %s, %s)', (1, 2, 3))]
+
+    DB.execute = x = seq(
+        rs2csr(qw('id foo_id bar'), (1, 1, 'A'), (2, 1, 'B'), (3, 2, 'C')),
+        rs2csr(qw('id foo'), (1, 'a'), (2, 'b')),
+        rs2csr(qw('id bar_id baz'), (1, 1, ''), (2, 1, ''), (3, 3, '')),
+        rs2csr(qw('bar_id foo_id'), (3, 2)))
+    bars = [*Bar.where(bar=NE('')).preload('foo', 'bazs.bar', 'bar2')]
+    del DB.execute
+    assert len(x.args) == 4
+    assert [b.foo.foo for b in bars] == ['a', 'a', 'b']
+    assert bars[0].foo is bars[1].foo
+    assert [[z.id for z in b.bazs] for b in bars] == [[1, 2], [], [3]]
+    assert bars[0].bazs[1].bar is bars[0]
+    assert [b.bar2 and b.bar2.foo_id for b in bars] == [None, None, 2]
+    assert bars[2].bar2.bar is bars[2]
+
+    DB.execute = x = seq(
+        rs2csr(qw('id foo'), (1, 'a')),
+        rs2csr(qw('id foo_id bar'), (1, 1, 'A')))
+    foo = Foo.query().preload('bars').first()
+    assert foo.bars[0].foo is foo
+    assert x.args[1] == (
+        'SELECT * FROM bars t1 WHERE foo_id IN (%s) ORDER BY id', (1,))
+
+    with pytest.raises(TypeError) as e:
+        Foo.query().preload('bars.x')._preload([foo])
+    assert e.value.args == ("unknown relation: 'bars.x'",)
+
+
+def test_Query_columns():
+    Foo, Bar, Bar2, Baz = models()
+    x = rs2csr(qw('id is_last n'), (1, True, 0.5), (2, None, None),
+               (3, False, 2))
+    Foo.DB.stream = lambda sql, vs, size: x(sql, vs, size)
+
+    xs = Baz.where(bar_id=1).columns('id', 'is_last', SQL('n'), batch_size=2)
+    assert last_x() == (
+        'SELECT id, is_last, n FROM bazs t1 WHERE bar_id = %s', (1,), 2)
+    assert [*xs] == ['id', 'is_last', 'n']
+    assert xs['id'] == array('q', [1, 2, 3])
+    assert xs['is_last'] == array('b', [1, 0, 0])
+    assert xs['n'] == array('d', [0.5, 0, 2])
+    assert xs.masks == {
+        'id': None, 'is_last': bytearray(b'\0\1\0'), 'n': bytearray(b'\0\1\0')}
+
+    x = rs2csr(qw('id n'), (1, 0.5))
+    xs = Baz.query().columns('id', SQL('n'), dtype=('i', 'f'))
+    assert xs['id'].typecode == 'i'
+    assert xs['n'].typecode == 'f'
+
+    with pytest.raises(TypeError) as e:
+        Baz.query().columns('id', dtype=('i', 'f'))
+    assert e.value.args == ('dtype must have 1 items',)
+
+
+def test_Query_count_strategy():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    DB.execute = x = seq(rs2csr(('n',), (30,)), rs2csr(('n',), (40,)))
+    q = Bar.where(bar='x').count_strategy('cached', 10).page(2, 10)
+    assert q.total_count == 30
+    assert q.page(2, 10).total_count == 30
+    assert q.page(3, 10).total_count == 30
+    assert x.args == [(
+        'SELECT COUNT(1) FROM bars t1 WHERE bar = %s', ('x',))]
+    assert [*DB.count_cache.values()][0][1] == 30
+    DB.count_cache.clear()
+    assert q.page(3, 10).total_count == 40
+
+    DB.execute = seq(rs2csr(('n',), (7,)))
+    q = Bar.where(id=SQL.ANY([1, 2])).count_strategy('cached').page(1)
+    assert q.total_count == 7
+    assert len(DB.count_cache) == 1
+
+    Q = Bar.Query
+    n, Q.IN_MAX = Q.IN_MAX, 2
+    DB.execute = seq(rs2csr(('n',), (2,)), rs2csr(('n',), (1,)))
+    q = Bar.query().where_in(id=(1, 2, 3)).count_strategy('approximate')
+    assert q.total_count == 3
+    Q.IN_MAX = n
+
+    xs = []
+
+    def count_estimate(sql, t):
+        xs.append((sql, t))
+        return 5
+    DB.count_estimate = count_estimate
+    Bar.COUNT_STRATEGY = 'approximate'
+    q = Bar.query().page(3, 10)
+    assert q.total_count == 5
+    assert q.last_page == 3
+    assert [*q.pages()] == [1, 2, 3]
+    assert q.where(bar='x').page(1).total_count == 5
+    assert xs == [
+        (SQL('SELECT 1 FROM bars t1'), 'bars'),
+        (SQL('SELECT 1 FROM bars t1 WHERE bar = %s', 'x'), None)]
+
+    with pytest.raises(TypeError) as e:
+        q.count_strategy('x')
+    assert e.value.args == ("unknown count strategy: 'x'",)
+
+
+def test_Query_cached():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    xs = [rs2csr(('id', 'bar'), (i, 'x')) for i in range(9)]
+    xs[3] = xs[5] = lambda *args: 1
+    DB.execute = x = seq(*xs)
+    q = Bar.where(bar='x').cached(30)
+    assert q.kw['cached'] == 30
+    assert Bar.query().cached().kw['cached'] == Bar.CACHE_TTL
+    assert 'cached' not in q.cached(False).kw
+    assert [r.id for r in q] == [0]
+    assert [r.id for r in Bar.where(bar='x').cached(30)] == [0]
+    assert len(x.args) == 1
+    assert DB.result_cache.stats() == dict(
+        hits=1, misses=1, size=1, maxsize=256)
+
+    assert [r.id for r in q.join('foo')] == [1]
+    assert [r.id for r in Bar.where(bar='x')] == [2]
+    Foo(id=1).insert()
+    assert [r.id for r in q] == [0]
+    assert [r.id for r in q.join('foo')] == [4]
+
+    Bar.where(id=1).update(bar='y').execute()
+    assert DB.table_versions == dict(foos=1, bars=1)
+    assert [r.id for r in q] == [6]
+    assert [r.id for r in q.for_update()] == [7]
+    DB.txn_depth = 1
+    assert [r.id for r in q] == [8]
+    DB.txn_depth = 0
+
+    DB.execute = x = seq(*(rs2csr(('id', 'bar'), (i, 'x')) for i in range(9)))
+    with DB.request_cache() as rc:
+        assert [r.id for r in Bar.where(bar='x')] == [0]
+        assert Bar.where(bar='x').peek().id == 0
+        assert [r.id for r in Bar.where(bar='y')] == [1]
+        Bar.where(id=1).delete().execute()
+        assert [r.id for r in Bar.where(bar='x')] == [3]
+        assert (rc.hits, rc.misses) == (1, 3)
+        DB.rollback = DB.__class__.rollback.__get__(DB)
+        DB._con_x = lambda x: None
+        DB.rollback()
+        assert not rc
+    assert DB.request_memo is None
+    assert [r.id for r in Bar.where(bar='x')] == [4]
+
+    tvs = {**DB.table_versions}
+    DB.execute = x = seq(lambda *a: die('!'))
+    with pytest.raises(RuntimeError):
+        Bar.where(id=1).delete().execute()
+    assert DB.table_versions == tvs  # bumped only once written
+
+
+def test_Query_where_in():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+    Q = Bar.Query
+
+    assert Bar.query().where_in(id=(1, 2)).sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id IN (%s, %s)', 1, 2)
+
+    ns = (Q.IN_MAX, Q.IN_TEMP_MIN)
+    Q.IN_MAX = 2
+    Q.IN_TEMP_MIN = 4
+    q = Bar.query().join('foo').where_in('t2', id=range(3))
+    for f in (q.sql, q.count_sql, q.exists_sql):
+        with pytest.raises(TypeError) as e:
+            f()
+        assert e.value.args == ('IN is split into chunks',)
+
+    DB.execute = x = seq(rs2csr(('n',), (2,)), rs2csr(('n',), (1,)))
+    assert q.count() == 3
+    assert x.args == [
+        ('SELECT COUNT(1) FROM bars t1 JOIN foos t2 ON t2.id = t1.foo_id '
+         'WHERE t2.id IN (%s, %s)', (0, 1)),
+        ('SELECT COUNT(1) FROM bars t1 JOIN foos t2 ON t2.id = t1.foo_id '
+         'WHERE t2.id IN (%s)', (2,))]
+
+    xs = []
+
+    def execute(sql, vs=None, as_=tuple):
+        xs.append((sql, [*vs] if isinstance(vs, list) else vs))
+        return 1 if as_ is int else rs2csr(('id',), (1,), (2,))(sql, vs, as_)
+    DB.execute = execute
+    bars = [*Bar.query().where_in(id=(1, 2, 3, 4, 2, 1)).where(bar='x')]
+    assert [b.id for b in bars] == [1, 2]
+    assert xs == [
+        ('CREATE TEMPORARY TABLE py3x_in_1 (v INT PRIMARY KEY)', None),
+        ('INSERT INTO py3x_in_1 (v) VALUES\n(%s),\n(%s)', [1, 2]),
+        ('INSERT INTO py3x_in_1 (v) VALUES\n(%s),\n(%s)', [3, 4]),
+        ('SELECT * FROM bars t1 WHERE id IN (SELECT v FROM py3x_in_1) '
+         'AND bar = %s', ('x',)),
+        ('DROP TEMPORARY TABLE py3x_in_1', None)]
+
+    class Doc(Bar.__base__):
+        DB_TABLE = 'docs'
+        id = INT(primary_key=True)
+        body = TEXT()
+
+    xs.clear()
+    [*Doc.query().where_in(body='abcd')]
+    assert xs[0] == ('CREATE TEMPORARY TABLE py3x_in_2 '
+                     '(v TEXT, KEY (v(255)))', None)
+
+    xs.clear()
+    q = Bar.query().where_in(id=(1, 2, 1, 3, 2)).update(bar='y')
+    assert q.execute() == 2
+    assert [x[1] for x in xs] == [('y', 1, 2), ('y', 3)]
+    Q.IN_MAX, Q.IN_TEMP_MIN = ns
+
+    class PgBar(postgres.Model):
+        DB = postgres.Database()
+        DB_TABLE = 'bars'
+        id = INT(primary_key=True)
+
+    assert PgBar.query().where_in(id=range(3)).sql() == SQL(
+        'SELECT * FROM bars t1 WHERE id = ANY(%s)', [0, 1, 2])
+
+    with pytest.raises(TypeError) as e:
+        Bar.query().where_in(id=(), bar=())
+    assert e.value.args == (
+        'where_in() takes 1 keyword argument but 2 were given',)
+
+
+def test_Query_raw_rows():
+    Foo, Bar, Bar2, Baz = models()
+    DB = Foo.DB
+
+    DB.execute = rs2csr(
+        qw('id bar_id is_last x'), (1, 2, 1, 'a'), (2, 2, 0, 'b'))
+    q = Baz.where(bar_id=2).select('id', 'bar_id', 'is_last', SQL('x'))
+    assert q.tuples() == [(1, 2, 1, 'a'), (2, 2, 0, 'b')]
+    assert q.tuples(db2py=True) == [(1, 2, True, 'a'), (2, 2, False, 'b')]
+    assert q.dicts(db2py=True)[1] == dict(id=2, bar_id=2, is_last=False, x='b')
+    assert last_x() == (
+        'SELECT id, bar_id, is_last, x FROM bazs t1 WHERE bar_id = %s', (2,),
+        tuple)
+
+    rs = q.rows()
+    assert (rs[0].id, rs[0].is_last, rs[1].x) == (1, 1, 'b')
+    assert not hasattr(rs[0], '__dict__')
+    assert q.rows(db2py=True)[0].__class__ is rs[0].__class__
+    assert q.rows(db2py=True)[0].is_last is True
+
+    DB.execute = rs2csr(('COUNT(1)', 'id'), (3, 1))
+    r = Baz.query().rows()[0]
+    assert r == (3, 1)
+    assert r._fields == ('_0', 'id')
@@ -1,4 +1,9 @@
-from py3x.orm import BulkLoader, SQL, BETWEEN, IN, LIKE, NOT, database
+from py3x.orm import BulkLoader, CopyLoader, SQL, ANY, BETWEEN, IN, LIKE, \
+    NOT, database, mysql, postgres
+from py3x.utils import die
+from time import sleep
+import pytest
+import threading
 
 
 def test_BulkLoader():
@@ -34,6 +39,222 @@ def test_BulkLoader():
         "INSERT INTO foos (id, created_at) VALUES\n"
         "(%s, NOW())", 1)
 
+    args.clear()
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'), max_bytes=140)
+    ldr.extend((i, 'x' * 30) for i in range(4))
+    assert [vs for s, vs in args] == [[0, 'x' * 30, 1, 'x' * 30]]
+    ldr.add(4, 'y' * 200).add(5, 'z').execute()
+    assert [len(vs) for s, vs in args] == [4, 4, 2, 2]
+    x = ldr.stats()
+    assert (x['rows'], x['flushes'], x['bytes']) == (6, 4, 537)
+    assert x['seconds'] >= 0
+
+    class Con:
+        def cursor(self):
+            return self
+
+        def execute(self, sql, vs):
+            args.append(sql)
+
+        def fetchone(self):
+            return (1000,)
+
+    db = mysql.Database()
+    db._con = Con()
+    args.clear()
+    mp = db.max_packet
+    db.max_packet = lambda: args.append('max_packet') or mp()
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'))
+    ldr.add(1, 'x').add(2, 'y')
+    assert ldr._mb == 950 - len(ldr._sql[0])
+    assert db._con.server_vars == {'max_allowed_packet': 1000}
+    ldr.execute()
+    ldr.add(3, 'z').execute()
+    assert args.count('SELECT @@max_allowed_packet') == 1
+    assert args.count('max_packet') == 1  # once per loader, not per flush
+
+
+def test_BulkLoader_upsert():
+    class Csr:
+        def __init__(self, rowcount, *rs):
+            self.rowcount = rowcount
+            self.rs = rs
+
+        def __iter__(self):
+            return iter(self.rs)
+
+    class Con:
+        server_vars = {'max_allowed_packet': 1 << 20}
+
+        def info(self):
+            return 'Records: 3  Duplicates: 2  Warnings: 0'
+
+    args = []
+    db = mysql.Database()
+    db._con = Con()
+    db.execute = lambda s, vs: args.append(s) or Csr(3)
+    ldr = BulkLoader(db, 'foos', ('id', 'foo', 'bar'), upsert=('foo', 'bar'))
+    ldr.extend(((1, 'a', 0), (2, 'b', 0), (3, 'c', 0))).execute()
+    assert args[-1].endswith(
+        '\nON DUPLICATE KEY UPDATE foo = VALUES(foo), bar = VALUES(bar)')
+    assert (ldr.count, ldr.inserted, ldr.updated) == (3, 1, 1)
+
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'), upsert=())
+    ldr.add(1, 'a').execute()
+    assert args[-1].endswith('\nON DUPLICATE KEY UPDATE id = id')
+    assert (ldr.inserted, ldr.updated) == (3, 0)
+
+    Con.info = lambda self: None  # a single row has no info
+    for rc, iu in ((1, (1, 0)), (2, (0, 1)), (0, (0, 0))):
+        db.execute = lambda s, vs: Csr(rc)
+        ldr = BulkLoader(db, 'foos', ('id', 'foo'), upsert=('foo',))
+        ldr.add(1, 'a').execute()
+        assert (ldr.inserted, ldr.updated) == iu
+
+    with pytest.raises(TypeError):
+        BulkLoader(db, 'foos', ('id',), suffix='X', upsert=())
+
+    db = postgres.Database()
+    db.execute = lambda s, vs: args.append(s) or Csr(2, (True,), (False,))
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'), upsert=('foo',),
+                     conflict=('id',), changed_only=True)
+    ldr.extend(((1, 'a'), (2, 'b'), (3, 'c'))).execute()
+    assert args[-1].endswith(
+        '\nON CONFLICT (id) DO UPDATE SET foo = EXCLUDED.foo '
+        'WHERE (foos.foo) IS DISTINCT FROM (EXCLUDED.foo) '
+        'RETURNING (xmax = 0)')
+    assert (ldr.count, ldr.inserted, ldr.updated) == (3, 1, 1)
+
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'), upsert=())
+    ldr.add(1, 'a').execute()
+    assert args[-1].endswith('\nON CONFLICT DO NOTHING')
+    assert (ldr.inserted, ldr.updated) == (2, 0)
+
+    with pytest.raises(TypeError) as e:
+        BulkLoader(db, 'foos', ('id', 'foo'), upsert=('foo',))
+    assert e.value.args == ('ON CONFLICT DO UPDATE needs conflict columns',)
+
+
+def test_BulkLoader_background():
+    xs = []
+
+    class Con:
+        def begin(self):
+            xs.append(('begin', threading.current_thread().name))
+
+        def close(self):
+            xs.append('close')
+
+        def commit(self):
+            xs.append('commit')
+
+        def cursor(self):
+            return self
+
+        def execute(self, sql, vs):
+            'fail' in vs and die('!')
+            xs.append(vs[::2])
+
+        def rollback(self):
+            xs.append('rollback')
+
+    class DB(database.Database):
+        def connect(self, **kw):
+            return Con()
+
+    db = DB()
+    with BulkLoader(db, 'foos', ('id', 'foo'), per=2, background=1) as ldr:
+        ldr.extend((i, 'x') for i in range(5))
+    assert xs == [('begin', 'py3x-bulk-loader'), [0, 1], [2, 3], [4],
+                  'commit', 'close']
+    assert (ldr.count, ldr.flushes) == (5, 3)
+    assert db.local.con is None
+
+    xs.clear()
+    ldr = BulkLoader(db, 'foos', ('id', 'foo'), per=1, background=2)
+    ldr.add(1, 'x').add(2, 'fail')
+    while ldr._error is None:
+        sleep(0.001)
+    with pytest.raises(RuntimeError):
+        ldr.add(3, 'x')
+    with pytest.raises(RuntimeError):
+        ldr.close()
+    assert xs[1:] == [[1], 'rollback', 'close']
+
+    xs.clear()
+    with pytest.raises(KeyError):
+        with BulkLoader(db, 'foos', ('id',), per=1, background=1) as ldr:
+            ldr.add(1).add(2)
+            raise KeyError
+    assert xs[-2:] == ['rollback', 'close']
+
+    def connect(**kw):
+        raise ConnectionError
+    db.connect = connect
+    ldr = BulkLoader(db, 'foos', ('id',), per=1, background=1)
+    ldr.add(1)
+    while ldr._error is None:
+        sleep(0.001)
+    with pytest.raises(ConnectionError):
+        ldr.add(2)
+    with pytest.raises(ConnectionError):
+        ldr.close()
+    assert db.local.con is None
+
+
+def test_CopyLoader():
+    xs = []
+
+    class Csr:
+        def copy_expert(self, sql, f):
+            xs.append(sql)
+            xs.extend(iter(lambda: f.read(8), b''))
+
+    class Con:
+        def cursor(self):
+            return Csr()
+
+    db = postgres.Database()
+    db._con = Con()
+    ldr = CopyLoader(db, 'foos', ('id', 'foo', 'bar'), per=2,
+                     py2dbs=(None, None, lambda v: v and sum(v)))
+    ldr.add(1, 'a\tb', [1, 2]).add(2, None, ())
+    assert xs[0] == 'COPY foos (id, foo, bar) FROM STDIN'
+    assert b''.join(xs[1:]) == b'1\ta\\tb\t3\n2\t\\N\t()\n'
+    assert all(len(x) <= 8 for x in xs[1:])
+
+    xs.clear()
+    ldr.add(3, True, None).extend((i, b'\x01', [i]) for i in range(4, 6))
+    assert ldr.execute() is None
+    assert [x for x in xs if isinstance(x, str)] == [xs[0]] * 2
+    assert b''.join(x for x in xs if isinstance(x, bytes)) == (
+        b'3\t1\t\\N\n4\t\\\\x01\t4\n5\t\\\\x01\t5\n')
+    assert ldr.count == 5
+
+    db = mysql.Database()
+
+    def execute(sql, vs, as_):
+        xs.append(sql)
+        if 'fail' in sql:
+            raise RuntimeError('!')
+        with open(vs[0], 'rb') as f:
+            xs.append(f.read())
+
+    db.execute = execute
+    xs.clear()
+    ldr = CopyLoader(db, 'foos', ('id', 'foo'))
+    ldr.extend((i, 'x\n') for i in range(1000))
+    assert xs[0] == ('LOAD DATA LOCAL INFILE %s INTO TABLE foos '
+                     'CHARACTER SET binary (id, foo)')
+    assert xs[1] == b''.join(b'%d\tx\\n\n' % i for i in range(1000))
+    assert ldr.count == 1000
+
+    ldr = CopyLoader(db, 'fail', ('id',))
+    with pytest.raises(RuntimeError):
+        ldr.extend((i,) for i in range(100000))
+    with pytest.raises(TypeError):  # raised in the writer thread
+        CopyLoader(db, 'foos', ('id',)).extend([(1,), (1, 2)])
+
 
 def test_SQL():
     x = SQL('foo = %s OR bar = %s', 'FOO', 'BAR')
@@ -46,6 +267,7 @@ def test_SQL():
 
 
 def test_Operator():
+    assert ANY(i for i in range(2)) == SQL('= ANY(%s)', [0, 1])
     assert BETWEEN(100, 200) == SQL('BETWEEN %s AND %s', 100, 200)
     assert IN(0, 1) == IN(i for i in range(2)) == SQL('IN (%s, %s)', 0, 1)
     assert IN() == SQL('IN (NULL)')
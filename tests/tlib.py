@@ -36,3 +36,13 @@ def r2csr(**r):
 
 def rs2csr(hs, *rs):
     return _x(hs, *rs)
+
+
+def seq(*xs):
+    it = iter(xs)
+
+    def x(*args):
+        x.args.append(args[:2])
+        return next(it)(*args)
+    x.args = []
+    return x